@@ -0,0 +1,463 @@
+"""Offline benchmarks for the compile / run / eval hot paths of exebench.
+
+    PYTHONPATH=. python benchmarks/bench.py run -o results.json
+    PYTHONPATH=. python benchmarks/bench.py compare base.json results.json
+
+`run` times every stage over the rows of benchmarks/corpus.jsonl (or --corpus) and
+writes per-stage latency percentiles and the rows/sec of evaluate_rows at several
+worker counts to a JSON file. `compare` prints two such files side by side and exits
+with status 1 if a stage got slower (or the throughput lower) by more than --threshold.
+
+The corpus has a few dozen rows in the Hugging Face layout, covering scalar, pointer,
+struct, string and float array signatures, with synthetic deps only or with real deps
+and IO pairs too. Their asm column was produced with `gcc -O0` on x86-64 (it's rebuilt
+with the local gcc on other hosts) and their IO pairs by running it.
+
+Nothing is downloaded. The Wrapper, decode and diff stages only need g++. The stages
+that need clang, llvm-extract, llc or clang++ (cpp2ass, ll2ass, eval_assembly) are
+reported as skipped when the tools are missing. ll2ass takes the IR from the rows'
+llvm_ir column if they have one, else from the output of cpp2ass.
+"""
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import exebench
+from exebench import (Wrapper, LLVMAssembler, cpp2ass, ll2ass, diff_io,
+                      eval_assembly, evaluate_rows, exebench_dict_to_dict,
+                      preprocessing_c_deps)
+
+_DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'corpus.jsonl')
+_FORMAT_VERSION = 1
+_PERCENTILES = (50, 90, 99)
+_NO_SAMPLES = collections.defaultdict(
+    lambda: 'no rows', {
+        'eval_assembly': 'no rows with real IO pairs',
+        'll2ass': 'no LLVM IR (no llvm_ir column and cpp2ass did not run)',
+    })
+_STAGES = ('decode', 'diff_io', 'compile', 'compile_cached', 'call',
+           'run_batch', 'eval_assembly', 'cpp2ass', 'll2ass')
+
+
+def _percentile(sorted_samples: List[float], percent: float) -> float:
+    # Nearest rank
+    rank = max(1, -(-len(sorted_samples) * percent // 100))
+    return sorted_samples[int(rank) - 1]
+
+
+def _summary(samples: List[float], errors: int) -> Dict:
+    summary = {'n': len(samples), 'errors': errors}
+    if samples:
+        samples = sorted(samples)
+        summary['mean'] = sum(samples) / len(samples)
+        for percent in _PERCENTILES:
+            summary[f'p{percent}'] = _percentile(samples, percent)
+        summary['max'] = samples[-1]
+    return summary
+
+
+def _timed(function: Callable, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def load_corpus(path: str, limit: Optional[int] = None) -> List[Dict]:
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return rows[:limit]
+
+
+def _row_assembly(row: Dict) -> str:
+    if platform.machine() in ('x86_64', 'AMD64'):
+        return row['asm']['code'][0]
+    c_code = preprocessing_c_deps(row) + row['func_def']
+    return subprocess.run(['gcc', '-S', '-O0', '-x', 'c', '-o', '-', '-'],
+                          input=c_code,
+                          capture_output=True,
+                          text=True,
+                          check=True).stdout
+
+
+def _row_wrapper(row: Dict, assembly: str, **kwargs) -> Wrapper:
+    c_deps, cpp_wrapper, _ = exebench._row_io_setup(row, 'auto')
+    return Wrapper(c_deps=c_deps + '\n',
+                   func_c_signature=row['func_head_types'].replace(
+                       'extern', ''),
+                   func_assembly=assembly,
+                   cpp_wrapper=cpp_wrapper,
+                   **kwargs)
+
+
+def _io_dicts(row: Dict):
+    _, _, io_pairs = exebench._row_io_setup(row, 'auto')
+    return io_pairs['input'], io_pairs['output']
+
+
+class _Bench:
+    def __init__(self, rows: List[Dict], repeat: int):
+        self.rows = rows
+        self.repeat = repeat
+        self.assemblies = [_row_assembly(row) for row in rows]
+        self.ll_codes = [(row.get('llvm_ir') or {}).get('code', [None])[0]
+                         for row in rows]
+
+    def decode(self):
+        samples = []
+        for row in self.rows:
+            inputs, outputs = _io_dicts(row)
+            for _ in range(self.repeat):
+                samples.append(
+                    _timed(lambda: [
+                        exebench_dict_to_dict(io_dict)
+                        for io_dict in inputs + outputs
+                    ]))
+        return samples, 0
+
+    def diff_io(self):
+        samples, errors = [], 0
+        for row in self.rows:
+            _, outputs = _io_dicts(row)
+            expected = [exebench_dict_to_dict(output) for output in outputs]
+            observed = [exebench_dict_to_dict(output) for output in outputs]
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                equal = all(map(diff_io, observed, expected))
+                samples.append(time.perf_counter() - start)
+                errors += not equal
+        return samples, errors
+
+    def _compile(self, assembler_backend):
+        samples, errors = [], 0
+        for row, assembly in zip(self.rows, self.assemblies):
+            start = time.perf_counter()
+            with _row_wrapper(row, assembly,
+                              assembler_backend=assembler_backend) as wrapper:
+                samples.append(time.perf_counter() - start)
+                errors += wrapper._compiled_exe_path is None
+        return samples, errors
+
+    def compile(self):
+        # Everything from scratch: wrapper + deps + assembly, then link
+        return self._compile(exebench._DefaultAssembler(cache_objects=False))
+
+    def compile_cached(self):
+        # Wrapper + deps object cached: assemble and link only
+        assembler_backend = exebench._DefaultAssembler()
+        self._compile(assembler_backend)
+        return self._compile(assembler_backend)
+
+    def _wrappers(self):
+        for row, assembly in zip(self.rows, self.assemblies):
+            inputs, outputs = _io_dicts(row)
+            with _row_wrapper(row, assembly) as wrapper:
+                yield wrapper, [exebench_dict_to_dict(i) for i in inputs
+                                ], [exebench_dict_to_dict(o) for o in outputs]
+
+    def call(self):
+        samples, errors = [], 0
+        for wrapper, inputs, outputs in self._wrappers():
+            for inp, expected in zip(inputs, outputs):
+                start = time.perf_counter()
+                observed = wrapper(inp)
+                samples.append(time.perf_counter() - start)
+                errors += observed is None or not diff_io(observed, expected)
+        return samples, errors
+
+    def run_batch(self):
+        samples, errors = [], 0
+        for wrapper, inputs, outputs in self._wrappers():
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                results = wrapper.run_batch(inputs)
+                samples.append(time.perf_counter() - start)
+                errors += results is None or not all(
+                    r.ok and diff_io(r.output, expected)
+                    for r, expected in zip(results, outputs))
+        return samples, errors
+
+    def eval_assembly(self):
+        samples, errors = [], 0
+        for row, assembly in zip(self.rows, self.assemblies):
+            if not row.get('real_io_pairs'):
+                continue  # eval_assembly only runs the real IO pairs
+            start = time.perf_counter()
+            success = eval_assembly(row, assembly)
+            samples.append(time.perf_counter() - start)
+            errors += not success
+        return samples, errors
+
+    def cpp2ass(self):
+        samples, errors = [], 0
+        for index, row in enumerate(self.rows):
+            code = preprocessing_c_deps(row) + row['func_def']
+            start = time.perf_counter()
+            success, ll_code, _ = cpp2ass(code, row['fname'])
+            samples.append(time.perf_counter() - start)
+            errors += not success
+            if self.ll_codes[index] is None:
+                self.ll_codes[index] = ll_code
+        return samples, errors
+
+    def ll2ass(self):
+        samples, errors = [], 0
+        for ll_code in self.ll_codes:
+            if ll_code is None:
+                continue
+            start = time.perf_counter()
+            s_code = ll2ass(ll_code)
+            samples.append(time.perf_counter() - start)
+            errors += s_code is None
+        return samples, errors
+
+
+def _missing_tools(stage: str) -> List[str]:
+    tools = {
+        'eval_assembly': [LLVMAssembler.compiler],
+        'cpp2ass': [exebench._CLANG, exebench._LLVM_EXTRACT, exebench._LLC],
+        'll2ass': [exebench._LLC],
+    }.get(stage, ['g++'])
+    return [tool for tool in tools if shutil.which(tool) is None]
+
+
+def _tool_version(tool: str) -> Optional[str]:
+    if shutil.which(tool) is None:
+        return None
+    try:
+        output = subprocess.run([tool, '--version'],
+                                capture_output=True,
+                                text=True,
+                                timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return next((line.strip() for line in output.splitlines() if line.strip()),
+                '')
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _throughput(rows: List[Dict], assemblies: List[str], workers: int,
+                repeat: int) -> Dict:
+    assemblies = {id(row): assembly for row, assembly in zip(rows, assemblies)}
+    rows = rows * repeat
+    start = time.perf_counter()
+    results = list(
+        evaluate_rows(rows, lambda row: assemblies[id(row)], workers=workers))
+    seconds = time.perf_counter() - start
+    return {
+        'rows': len(rows),
+        'seconds': seconds,
+        'rows_per_sec': len(rows) / seconds,
+        'passed': sum(result.success for result in results),
+    }
+
+
+def run(args) -> Dict:
+    rows = load_corpus(args.corpus, args.limit)
+    stages = args.stages.split(',') if args.stages else list(_STAGES)
+    unknown = set(stages) - set(_STAGES)
+    if unknown:
+        raise SystemExit(f'unknown stages: {", ".join(sorted(unknown))}')
+    workers = [int(w) for w in args.workers.split(',') if w]
+    env = {k: v for k, v in os.environ.items() if k.startswith('EXEBENCH_')}
+    if args.cache_dir is None:
+        # Start from empty build caches, so that runs are comparable
+        cache_dir = tempfile.mkdtemp(prefix='exebench_bench_')
+        os.environ['EXEBENCH_CACHE_DIR'] = cache_dir
+    else:
+        os.environ['EXEBENCH_CACHE_DIR'] = args.cache_dir
+
+    results = {
+        'format': _FORMAT_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'host': {
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'tools': {
+                tool: _tool_version(tool)
+                for tool in ('g++', 'gcc', LLVMAssembler.compiler,
+                             exebench._CLANG, exebench._LLVM_EXTRACT,
+                             exebench._LLC)
+            },
+        },
+        'config': {
+            'corpus': os.path.basename(args.corpus),
+            'rows': len(rows),
+            'repeat': args.repeat,
+            'workers': workers,
+            'env': env,
+        },
+        'stages': {},
+        'throughput': {},
+    }
+    try:
+        bench = _Bench(rows, args.repeat)
+        for stage in stages:
+            missing = _missing_tools(stage)
+            if missing:
+                results['stages'][stage] = {
+                    'skipped': f'not found: {", ".join(missing)}'
+                }
+                logging.warning(f'{stage}: skipped, {", ".join(missing)} not found')
+                continue
+            start = time.perf_counter()
+            samples, errors = getattr(bench, stage)()
+            if not samples:
+                results['stages'][stage] = {'skipped': _NO_SAMPLES[stage]}
+                logging.warning(f'{stage}: skipped, {_NO_SAMPLES[stage]}')
+                continue
+            results['stages'][stage] = _summary(samples, errors)
+            logging.warning(
+                f'{stage}: {_format_stage(results["stages"][stage])} ({time.perf_counter() - start:.1f}s)'
+            )
+        if 'g++' not in _missing_tools('throughput'):
+            for worker_count in workers:
+                throughput = _throughput(rows, bench.assemblies, worker_count,
+                                         args.repeat)
+                results['throughput'][str(worker_count)] = throughput
+                logging.warning(
+                    f'evaluate_rows, {worker_count} workers: {throughput["rows_per_sec"]:.2f} rows/s, '
+                    f'{throughput["passed"]}/{throughput["rows"]} passed')
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.1f}us'
+    if seconds < 1:
+        return f'{seconds * 1e3:.2f}ms'
+    return f'{seconds:.2f}s'
+
+
+def _format_stage(summary: Dict) -> str:
+    if 'skipped' in summary:
+        return f'skipped ({summary["skipped"]})'
+    percentiles = ' '.join(f'p{percent}={_format_seconds(summary[f"p{percent}"])}'
+                           for percent in _PERCENTILES)
+    return f'n={summary["n"]} {percentiles} errors={summary["errors"]}'
+
+
+def _change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if not before or after is None:
+        return None
+    return after / before - 1
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> List[str]:
+    """Prints base and new side by side; returns the regressions beyond threshold."""
+    regressions = []
+    print(f'{"stage":<16}{"metric":<8}{"base":>12}{"new":>12}{"change":>10}')
+    for stage in sorted(set(base['stages']) | set(new['stages'])):
+        base_stage = base['stages'].get(stage, {})
+        new_stage = new['stages'].get(stage, {})
+        if 'n' not in base_stage and 'n' not in new_stage:
+            continue  # skipped or not run in both
+        for metric in [f'p{percent}' for percent in _PERCENTILES] + ['mean']:
+            before, after = base_stage.get(metric), new_stage.get(metric)
+            change = _change(before, after)
+            if metric == 'p50' and change is not None and change > threshold:
+                regressions.append(f'{stage} p50 {change:+.1%}')
+            print(f'{stage:<16}{metric:<8}{_format_seconds(before):>12}'
+                  f'{_format_seconds(after):>12}'
+                  f'{"" if change is None else f"{change:+.1%}":>10}')
+        if new_stage.get('errors', 0) > base_stage.get('errors', 0):
+            regressions.append(
+                f'{stage} errors {base_stage.get("errors", 0)} -> {new_stage["errors"]}'
+            )
+    for workers in sorted(set(base['throughput']) | set(new['throughput']),
+                          key=int):
+        before = base['throughput'].get(workers, {}).get('rows_per_sec')
+        after = new['throughput'].get(workers, {}).get('rows_per_sec')
+        change = _change(before, after)
+        if change is not None and change < -threshold:
+            regressions.append(f'rows/s with {workers} workers {change:+.1%}')
+        print(f'{"rows/s":<16}{workers + "w":<8}'
+              f'{"-" if before is None else f"{before:.2f}":>12}'
+              f'{"-" if after is None else f"{after:.2f}":>12}'
+              f'{"" if change is None else f"{change:+.1%}":>10}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', help='JSON results file')
+    run_parser.add_argument('--corpus', default=_DEFAULT_CORPUS)
+    run_parser.add_argument('--limit', type=int, help='only the first N rows')
+    run_parser.add_argument(
+        '--stages', help=f'comma-separated subset of {",".join(_STAGES)}')
+    run_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='repetitions of the cheap stages and of the corpus for throughput')
+    run_parser.add_argument('--workers',
+                            default=','.join(
+                                map(str, sorted({1, 2, 4, os.cpu_count()}))),
+                            help='evaluate_rows worker counts, empty to skip')
+    run_parser.add_argument(
+        '--cache-dir',
+        help='build cache dir to use (default: a fresh temporary one)')
+    compare_parser = subparsers.add_parser('compare',
+                                           help='compare two results files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold',
+                                type=float,
+                                default=0.1,
+                                help='relative slowdown reported as regression')
+    args = parser.parse_args()
+
+    # exebench logs every failed row at INFO and DEBUG level
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.command == 'run':
+        results = run(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, sys.stdout, indent=2)
+            print()
+        return 0
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    for regression in regressions:
+        print(f'REGRESSION: {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
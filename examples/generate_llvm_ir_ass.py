@@ -1,9 +1,9 @@
 
 import re
-from typing import Dict
+from typing import Dict, Optional
 from datasets import load_dataset, load_from_disk, concatenate_datasets
 from exebench import (Wrapper, LLVMAssembler, diff_io, exebench_dict_to_dict,
-                      cpp2ass, ll2ass)
+                      cpp2ass, ll2ass, run_sharded)
 import logging
 
 logging.basicConfig(
@@ -128,6 +128,23 @@ def generate_llvm_ir_ass_for_one_split(path: str, saved_path: str):
     can_execute_dataset.save_to_disk(saved_path)
 
 
+def compile_and_check_row(row: Dict) -> Optional[Dict]:
+    # compile_row_with_assembly, filter_exebench_dataset and executable in one pass
+    row = compile_row_with_assembly(dict(row))
+    if not filter_exebench_dataset(row) or not executable(row):
+        return None
+    return row
+
+
+def generate_llvm_ir_ass_for_one_split_resumable(path: str, saved_dir: str):
+    # Same as generate_llvm_ir_ass_for_one_split, but commits every 10k rows to
+    # saved_dir/shard-*.jsonl and picks up where it left off if restarted
+    dataset = load_from_disk(path)
+    manifest = run_sharded(dataset, compile_and_check_row, saved_dir, workers=40)
+    kept = sum(shard['rows_out'] for shard in manifest['shards'].values())
+    print(f"before filter:{len(dataset)} after filter:{kept}")
+
+
 def compile_all_dataset_splits():
     # for i in range(0, 8):
     #     path = f"/data/xiachunwei/Datasets/filtered_exebench/train_synth_rich_io_filtered_llvm_ir/train_synth_rich_io_filtered_{i}_llvm_ir"
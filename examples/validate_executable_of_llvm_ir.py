@@ -4,7 +4,7 @@ import os
 import datasets
 from datasets import load_from_disk
 from exebench import (Wrapper, LLVMAssembler, diff_io, exebench_dict_to_dict,
-                      ll2ass)
+                      llvm_pipeline)
 import logging
 
 import re
@@ -75,8 +75,6 @@ def strip_bss_in_assembly(asm: str)->str:
     idx = asm.find(pattern)
     return asm[:idx+len(pattern)]
 
-import tempfile
-import subprocess
 
 def main():
     i=0
@@ -89,18 +87,14 @@ def main():
         if func_name is None:
             logging.error(f"Can not extract function name from {row['func_head']}")
             continue
-        with tempfile.NamedTemporaryFile(delete=False, mode='w') as temp_file:
-            temp_file.write(row["llvm_ir"]["code"][-1])
-            temp_file.flush()
-            result = subprocess.run(["llvm-extract", "-func", func_name, "-S", temp_file.name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if result.returncode != 0:
-                print("Error: ", result.stderr.decode())
-            asm = ll2ass(result.stdout.decode())
-            if asm is None:
-                continue
-            # asm = strip_bss_in_assembly(asm)
-            success = eval_assembly(row, asm)
-            print("success: ", success)
+        result = llvm_pipeline(row["llvm_ir"]["code"][-1], func_name, language='ll')
+        if not result.success:
+            print("Error: ", result.error.stage, result.error.stderr)
+            continue
+        asm = result.s_code
+        # asm = strip_bss_in_assembly(asm)
+        success = eval_assembly(row, asm)
+        print("success: ", success)
 
 
 def test():
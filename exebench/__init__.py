@@ -1,8 +1,10 @@
 import math
+import bisect
 import json
 from pathlib import Path
 import subprocess
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List, Union, Iterable, Iterator, Callable
+from dataclasses import dataclass, field
 import tempfile
 import contextlib
 import os
@@ -11,7 +13,30 @@ import glob
 import re
 from ast import literal_eval
 import logging
-import re
+import hashlib
+import fcntl
+import time
+import itertools
+import collections
+import collections.abc
+import concurrent.futures
+import asyncio
+import weakref
+import atexit
+import errno
+import multiprocessing.util
+import functools
+import io
+import queue
+import signal
+import tarfile
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import numpy as np
+except ImportError:  # optional, only used to compare long float arrays
+    np = None
 
 # Set up logging
 logging.basicConfig(
@@ -20,8 +45,13 @@ logging.basicConfig(
     level=logging.DEBUG)
 
 __all__ = [
-    'diff_io', 'Wrapper', 'exebench_dict_to_dict', 'LLVMAssembler', 'cpp2ass',
-    'll2ass'
+    'diff_io', 'first_mismatch', 'IOMismatch', 'Wrapper', 'IOResult', 'BuildCache', 'exebench_dict_to_dict',
+    'decode_io_pairs',
+    'LLVMAssembler', 'cpp2ass', 'll2ass', 'evaluate_rows', 'RowResult',
+    'set_async_concurrency', 'TRANSPORT_FD', 'TRANSPORT_FILE', 'ScratchSpace',
+    'sweep_scratch_space', 'llvm_pipeline', 'PipelineResult', 'StageResult',
+    'stream_split', 'LazyRow', 'run_sharded', 'metrics', 'MetricsRegistry',
+    'ResourceLimits'
 ]
 
 __version__ = 0.1
@@ -32,23 +62,380 @@ _DEFAULT_CMD_TIMEOUT = 15
 _ROOT_PATH_FOR_JSON_HPP = os.path.dirname(__file__)
 _SYNTH_LIBS_PATH = os.path.dirname(__file__)
 
+# Instrumentation. Off unless EXEBENCH_METRICS=1 (or EXEBENCH_METRICS_DIR is set, or
+# metrics.enabled is set to True); the instrumented code only checks metrics.enabled.
+
+_TIMING_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricsRegistry:
+    """In-process counters and timing histograms, identified by a name and labels.
+
+    snapshot() returns them as a JSON-serializable dict, and merge() adds a snapshot
+    (e.g. from another process) to the registry. to_prometheus() renders them in the
+    Prometheus text format. A forked child starts from an empty registry.
+
+    With dump_dir set (EXEBENCH_METRICS_DIR), every process that records something
+    keeps its snapshot in dump_dir/exebench_<host>_<pid>.json, rewritten at most every
+    dump_interval seconds and when the process exits, so that workers of any process
+    pool are covered (a worker killed by a signal, e.g. by Pool.terminate(), loses at
+    most its last dump_interval seconds). MetricsRegistry.load(dump_dir) adds them all
+    up.
+    """
+
+    def __init__(self,
+                 enabled: bool = False,
+                 dump_dir: Optional[str] = None,
+                 dump_interval: float = 2.0):
+        self.enabled = enabled or dump_dir is not None
+        self.dump_dir = dump_dir
+        self.dump_interval = dump_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next_dump = 0.0
+        self._counters = {}  # (name, labels) -> value
+        self._timings = {}  # (name, labels) -> [count, sum, min, max, *buckets]
+
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()  # first use, or inherited through fork
+        self._counters = {}
+        self._timings = {}
+        if self.dump_dir is not None:
+            self._next_dump = 0.0
+            atexit.register(self._dump_at_exit)
+            # multiprocessing workers leave through os._exit, which skips atexit
+            multiprocessing.util.Finalize(self,
+                                          self._dump_at_exit,
+                                          exitpriority=0)
+
+    def _recorded(self):
+        if self.dump_dir is not None and time.monotonic() >= self._next_dump:
+            self._next_dump = time.monotonic() + self.dump_interval
+            self._dump()
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_pid()
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._recorded()
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_pid()
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = self._timings[key] = [
+                    0, 0.0, seconds, seconds
+                ] + [0] * (len(_TIMING_BUCKETS) + 1)
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = min(timing[2], seconds)
+            timing[3] = max(timing[3], seconds)
+            timing[4 + bisect.bisect_left(_TIMING_BUCKETS, seconds)] += 1
+            self._recorded()
+
+    def _snapshot(self) -> Dict:
+        return {
+            'counters': [{
+                'name': name,
+                'labels': dict(labels),
+                'value': value
+            } for (name, labels), value in self._counters.items()],
+            'timings': [{
+                'name': name,
+                'labels': dict(labels),
+                'count': timing[0],
+                'sum': timing[1],
+                'min': timing[2],
+                'max': timing[3],
+                'buckets': timing[4:]
+            } for (name, labels), timing in self._timings.items()],
+            'bucket_bounds': list(_TIMING_BUCKETS),
+        }
+
+    def snapshot(self, reset: bool = False) -> Dict:
+        """The counters and timings recorded so far; reset=True also clears them."""
+        with self._lock:
+            self._check_pid()
+            snapshot = self._snapshot()
+            if reset:
+                self._counters = {}
+                self._timings = {}
+        return snapshot
+
+    def merge(self, snapshot: Dict):
+        """Adds the counters and timings of a snapshot, even if the registry is disabled."""
+        if snapshot['bucket_bounds'] != list(_TIMING_BUCKETS):
+            raise ValueError('snapshot has different timing buckets')
+        with self._lock:
+            self._check_pid()
+            for counter in snapshot['counters']:
+                key = (counter['name'], tuple(sorted(counter['labels'].items())))
+                self._counters[key] = self._counters.get(key,
+                                                         0) + counter['value']
+            for other in snapshot['timings']:
+                key = (other['name'], tuple(sorted(other['labels'].items())))
+                timing = self._timings.get(key)
+                if timing is None:
+                    self._timings[key] = [
+                        other['count'], other['sum'], other['min'],
+                        other['max']
+                    ] + list(other['buckets'])
+                    continue
+                timing[0] += other['count']
+                timing[1] += other['sum']
+                timing[2] = min(timing[2], other['min'])
+                timing[3] = max(timing[3], other['max'])
+                timing[4:] = [a + b for a, b in zip(timing[4:], other['buckets'])]
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._timings = {}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self) -> str:
+        """The counters (as counters) and timings (as histograms, in seconds)."""
+        snapshot = self.snapshot()
+
+        def series(name, labels, extra=()):
+            labels = list(labels.items()) + list(extra)
+            if not labels:
+                return name
+            text = ','.join(
+                f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                for key, value in labels)
+            return f'{name}{{{text}}}'
+
+        lines = []
+        typed = set()
+        for counter in sorted(snapshot['counters'],
+                              key=lambda c: (c['name'], sorted(c['labels'].items()))):
+            if counter['name'] not in typed:
+                typed.add(counter['name'])
+                lines.append(f"# TYPE {counter['name']} counter")
+            lines.append(
+                f"{series(counter['name'], counter['labels'])} {counter['value']}")
+        for timing in sorted(snapshot['timings'],
+                             key=lambda t: (t['name'], sorted(t['labels'].items()))):
+            name = timing['name']
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, bucket in zip(
+                    snapshot['bucket_bounds'] + ['+Inf'], timing['buckets']):
+                cumulative += bucket
+                lines.append(
+                    f"{series(name + '_bucket', timing['labels'], [('le', bound)])} {cumulative}"
+                )
+            lines.append(
+                f"{series(name + '_sum', timing['labels'])} {timing['sum']}")
+            lines.append(
+                f"{series(name + '_count', timing['labels'])} {timing['count']}")
+        return ''.join(line + '\n' for line in lines)
+
+    def dump(self, path: str):
+        """Writes snapshot() to `path`, atomically."""
+        _write_atomically(path, lambda f: json.dump(self.snapshot(), f))
+
+    def _dump(self):
+        # Called with the lock held. No fsync: this runs on the hot path
+        if not (self._counters or self._timings):
+            return
+        path = os.path.join(self.dump_dir, f'{_get_host_process_id()}.json')
+        with contextlib.suppress(OSError):
+            os.makedirs(self.dump_dir, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(f'{path}.tmp', path)
+
+    def _dump_at_exit(self):
+        if self._pid == os.getpid() and self.dump_dir is not None:
+            with self._lock:
+                self._dump()
+
+    @classmethod
+    def load(cls, path: str) -> 'MetricsRegistry':
+        """A registry with the sum of a snapshot file or of every *.json in a directory."""
+        registry = cls()
+        paths = sorted(glob.glob(os.path.join(
+            path, '*.json'))) if os.path.isdir(path) else [path]
+        for snapshot_path in paths:
+            with open(snapshot_path) as f:
+                registry.merge(json.load(f))
+        return registry
 
-def _run_command(
-        command: str,
-        stdin: Optional[str] = None,
-        timeout: Optional[int] = _DEFAULT_CMD_TIMEOUT) -> Tuple[str, str]:
-    output = subprocess.run(command.split(),
-                            capture_output=True,
-                            text=True,
-                            input=stdin,
-                            timeout=timeout)
+
+metrics = MetricsRegistry(
+    enabled=os.environ.get('EXEBENCH_METRICS', '0') == '1',
+    dump_dir=os.environ.get('EXEBENCH_METRICS_DIR') or None)
+
+
+def _record_command(program: str, returncode, elapsed: float, bytes_in: int,
+                    bytes_out: int):
+    """Records one child process; returncode is 'timeout' if it was killed for it."""
+    metrics.observe('exebench_command_seconds', elapsed, program=program)
+    metrics.count('exebench_commands_total',
+                  program=program,
+                  exit_code=str(returncode))
+    metrics.count('exebench_command_bytes_total',
+                  bytes_in,
+                  program=program,
+                  direction='in')
+    metrics.count('exebench_command_bytes_total',
+                  bytes_out,
+                  program=program,
+                  direction='out')
+
+
+def _command_program(args: List[str]) -> str:
+    # Compilers are called by name; harness executables by their (unique) path
+    return 'harness' if os.path.isabs(args[0]) else os.path.basename(args[0])
+
+
+def _collecting_metrics(function, collect_metrics, *args):
+    """Runs function(*args) in a pool worker and returns its result with the metrics it
+    recorded (None if collect_metrics is False), so the parent can merge them."""
+    metrics.enabled = collect_metrics
+    if not collect_metrics:
+        return function(*args), None
+    metrics.dump_dir = None  # the parent dumps them, if needed
+    return function(*args), metrics.snapshot(reset=True)
+
+
+def _run_command(command: str,
+                 stdin: Optional[str] = None,
+                 timeout: Optional[int] = _DEFAULT_CMD_TIMEOUT,
+                 pass_fds: Tuple[int, ...] = ()) -> Tuple[str, str]:
+    args = command.split()
+    start = time.monotonic()
+    try:
+        output = subprocess.run(args,
+                                capture_output=True,
+                                text=True,
+                                input=stdin,
+                                timeout=timeout,
+                                pass_fds=pass_fds)
+    except subprocess.TimeoutExpired:
+        if metrics.enabled:
+            _record_command(_command_program(args), 'timeout',
+                            time.monotonic() - start, len(stdin or ''), 0)
+        raise
     stdout = output.stdout.decode('utf-8') if isinstance(
         output.stdout, bytes) else output.stdout
     stderr = output.stderr.decode('utf-8') if isinstance(
         output.stderr, bytes) else output.stderr
+    if metrics.enabled:
+        _record_command(_command_program(args), output.returncode,
+                        time.monotonic() - start, len(stdin or ''),
+                        len(stdout) + len(stderr))
     return output.returncode, stdout, stderr
 
 
+def _run_steps(steps):
+    """Drives a generator that yields commands (or tuples of _run_command arguments) and
+    receives their _run_command result; exceptions are thrown back into it."""
+    try:
+        command = next(steps)
+        while True:
+            try:
+                result = _run_command(
+                    *command if isinstance(command, tuple) else (command, ))
+            except BaseException as e:
+                command = steps.throw(e)
+            else:
+                command = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
+# asyncio counterparts, for services that keep many compiles and runs in flight on one
+# event loop. At most `_ASYNC_CONCURRENCY` child processes run at once (per loop).
+
+_ASYNC_CONCURRENCY = os.cpu_count() or 1
+_ASYNC_SEMAPHORES = weakref.WeakKeyDictionary()
+
+
+def set_async_concurrency(limit: int):
+    """Sets how many child processes the async API runs at once, per event loop."""
+    global _ASYNC_CONCURRENCY
+    _ASYNC_CONCURRENCY = limit
+    _ASYNC_SEMAPHORES.clear()
+
+
+def _async_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _ASYNC_SEMAPHORES:
+        _ASYNC_SEMAPHORES[loop] = asyncio.Semaphore(_ASYNC_CONCURRENCY)
+    return _ASYNC_SEMAPHORES[loop]
+
+
+async def _arun_command(command: str,
+                        stdin: Optional[str] = None,
+                        timeout: Optional[int] = _DEFAULT_CMD_TIMEOUT,
+                        pass_fds: Tuple[int, ...] = ()) -> Tuple[str, str]:
+    args = command.split()
+    async with _async_semaphore():
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=None if stdin is None else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+            pass_fds=pass_fds)
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(None if stdin is None else stdin.
+                                    encode('utf-8')), timeout)
+        except asyncio.TimeoutError:
+            if metrics.enabled:
+                _record_command(_command_program(args), 'timeout',
+                                time.monotonic() - start, len(stdin or ''), 0)
+            raise subprocess.TimeoutExpired(command, timeout)
+        finally:
+            # Timed out or cancelled: never leave the child (or e.g. the compiler's
+            # cc1plus) behind
+            if process.returncode is None:
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(process.pid, 9)
+                await asyncio.shield(process.wait())
+    if metrics.enabled:
+        _record_command(_command_program(args), process.returncode,
+                        time.monotonic() - start, len(stdin or ''),
+                        len(stdout) + len(stderr))
+    return process.returncode, stdout.decode('utf-8', 'replace'), \
+        stderr.decode('utf-8', 'replace')
+
+
+async def _arun_steps(steps):
+    """Async version of _run_steps."""
+    try:
+        command = next(steps)
+        while True:
+            try:
+                result = await _arun_command(
+                    *command if isinstance(command, tuple) else (command, ))
+            except BaseException as e:
+                command = steps.throw(e)
+            else:
+                command = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+
+
 def _get_host_process_id():
     process_id = 'exebench_' + os.uname()[1] + '_' + str(os.getpid())
     return process_id
@@ -62,30 +449,185 @@ def _cleanup(path_pattern):
             pass
 
 
+class ScratchSpace:
+    """A private directory for the temporary files of one process.
+
+    It is named exebench_<host>_<pid> and is created under `base_dir`. The default
+    base dir is EXEBENCH_SCRATCH_DIR, or /dev/shm if it is a tmpfs that allows
+    executables, or else the system temp dir. Creating one first sweeps the
+    directories (and the loose exebench_<host>_<pid>* files written by older
+    versions, in the system temp dir) of processes on this host that no longer exist.
+
+    Allocations fail with OSError(ENOSPC) once the directory holds more than
+    `max_bytes` or the file system has less than `min_free_bytes` left. The default
+    limits come from EXEBENCH_SCRATCH_BYTES and EXEBENCH_SCRATCH_MIN_FREE_BYTES.
+
+    Every process gets a default scratch space, removed when it exits. Using a
+    ScratchSpace as a context manager makes it the current one until the block exits
+    and then removes it.
+    """
+
+    def __init__(self,
+                 base_dir: Optional[str] = None,
+                 max_bytes: Optional[int] = None,
+                 min_free_bytes: Optional[int] = None):
+        self.base_dir = base_dir if base_dir is not None else _default_scratch_base_dir(
+        )
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.environ.get('EXEBENCH_SCRATCH_BYTES', 4 * 1024**3))
+        self.min_free_bytes = min_free_bytes if min_free_bytes is not None else int(
+            os.environ.get('EXEBENCH_SCRATCH_MIN_FREE_BYTES', 256 * 1024**2))
+        self.pid = os.getpid()
+        sweep_scratch_space(self.base_dir)
+        if os.path.realpath(self.base_dir) != os.path.realpath(
+                tempfile.gettempdir()):
+            sweep_scratch_space(tempfile.gettempdir())
+        name = _get_host_process_id()
+        scratch_id = next(_SCRATCH_IDS)
+        if scratch_id:
+            name += f'_{scratch_id}'
+        self.path = os.path.join(self.base_dir, name)
+        # Whatever is there belongs to a dead process that had our pid
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+    def check_quota(self):
+        if shutil.disk_usage(self.path).free < self.min_free_bytes:
+            raise OSError(errno.ENOSPC,
+                          f'Less than {self.min_free_bytes} bytes free',
+                          self.path)
+        used = 0
+        for entry in os.scandir(self.path):
+            try:
+                used += entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                pass
+        if used > self.max_bytes:
+            raise OSError(errno.ENOSPC,
+                          f'Scratch space over its {self.max_bytes} byte quota',
+                          self.path)
+
+    def cleanup(self):
+        # Forked children inherit the object (and the exit hooks) but not the directory
+        if os.getpid() == self.pid:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        _SCRATCH_STACK.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _SCRATCH_STACK.remove(self)
+        self.cleanup()
+
+
+_SCRATCH_STACK = []
+_SCRATCH_IDS = itertools.count()
+_DEFAULT_SCRATCH = None
+
+
+def _default_scratch_base_dir() -> str:
+    base_dir = os.environ.get('EXEBENCH_SCRATCH_DIR')
+    if base_dir is not None:
+        return base_dir
+    try:
+        if not os.statvfs('/dev/shm').f_flag & os.ST_NOEXEC and os.access(
+                '/dev/shm', os.W_OK):
+            return '/dev/shm'
+    except (OSError, AttributeError):
+        pass
+    return tempfile.gettempdir()
+
+
+def _scratch_space() -> ScratchSpace:
+    global _DEFAULT_SCRATCH
+    if _SCRATCH_STACK and _SCRATCH_STACK[-1].pid == os.getpid():
+        return _SCRATCH_STACK[-1]
+    if _DEFAULT_SCRATCH is None or _DEFAULT_SCRATCH.pid != os.getpid():
+        del _SCRATCH_STACK[:]  # inherited through fork
+        _DEFAULT_SCRATCH = ScratchSpace()
+        atexit.register(_DEFAULT_SCRATCH.cleanup)
+        # multiprocessing workers leave through os._exit, which skips atexit
+        multiprocessing.util.Finalize(_DEFAULT_SCRATCH,
+                                      _DEFAULT_SCRATCH.cleanup,
+                                      exitpriority=0)
+    return _DEFAULT_SCRATCH
+
+
+def _pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def sweep_scratch_space(base_dir: Optional[str] = None) -> int:
+    """Removes what dead exebench processes of this host left in `base_dir`.
+
+    Returns the number of entries removed.
+    """
+    base_dir = base_dir if base_dir is not None else _default_scratch_base_dir(
+    )
+    pattern = re.compile(r'exebench_' + re.escape(os.uname()[1]) +
+                         r'_(\d+)(_\d+)?$')
+    # Older versions put files straight in the temp dir: the prefix, then the pid, then
+    # tempfile's 8 random characters and the suffix
+    legacy_pattern = re.compile(r'exebench_' + re.escape(os.uname()[1]) +
+                                r'_(\d+)[a-z0-9_]{8}(?:[.-]|$)')
+    removed = 0
+    try:
+        entries = list(os.scandir(base_dir))
+    except OSError:
+        return 0
+    for entry in entries:
+        match = pattern.match(entry.name)
+        if match and entry.is_dir(follow_symlinks=False):
+            if _pid_exists(int(match.group(1))):
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+            continue
+        match = legacy_pattern.match(entry.name)
+        if match is None or entry.is_dir(follow_symlinks=False) or _pid_exists(
+                int(match.group(1))):
+            continue
+        try:
+            os.remove(entry.path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 @contextlib.contextmanager
 def _get_tmp_path(content: Optional[str] = None,
                   suffix: Optional[str] = None,
                   delete=False) -> str:
-    prefix = _get_host_process_id()
-    try:
-        with tempfile.NamedTemporaryFile(prefix=prefix,
-                                         suffix=suffix,
-                                         delete=delete,
-                                         mode='w+') as ntf:
-            if content:
-                ntf.write(content)
-                ntf.flush()
-            yield ntf.name
-    except OSError:
-        _cleanup(os.path.join(tempfile.gettempdir(), prefix, '*'))
-        with tempfile.NamedTemporaryFile(prefix=prefix,
-                                         suffix=suffix,
-                                         delete=delete,
-                                         mode='w+') as ntf:
-            if content:
-                ntf.write(content)
-                ntf.flush()
-            yield ntf.name
+    """Yields the path of a new file in the current ScratchSpace.
+
+    With delete=False the file outlives the block and the caller owns it (it still
+    goes away with the scratch space).
+    """
+    scratch = _scratch_space()
+    scratch.check_quota()
+    with tempfile.NamedTemporaryFile(dir=scratch.path,
+                                     suffix=suffix,
+                                     delete=delete,
+                                     mode='w+') as ntf:
+        if content:
+            ntf.write(content)
+            ntf.flush()
+        yield ntf.name
 
 
 class _Assembler:
@@ -94,28 +636,409 @@ class _Assembler:
         raise NotImplemented
 
 
-class _DefaultAssembler(_Assembler):
+# Precompiled header for the harness includes. Re-parsing the 24k-line
+# nlohmann/json.hpp dominates the compile time of every wrapper, so (opt-in) we
+# build it once per toolchain and flag set and force-include it.
+
+_CXX_FLAGS = '-fpermissive -O0'
+_PCH_HEADER_NAME = 'exebench_pch.hpp'
+_PCH_HEADER = """#include <algorithm>
+#include <cstring>
+#include <fstream>
+#include <iomanip>
+#include <iostream>
+#include <string>
+#include <vector>
+#include <nlohmann/json.hpp>
+#include <clib/synthesizer.h>
+"""
+_PCH_SOURCES = [
+    os.path.join(_ROOT_PATH_FOR_JSON_HPP, 'nlohmann', 'json.hpp'),
+    os.path.join(_SYNTH_LIBS_PATH, 'clib', 'synthesizer.h')
+]
+_PCH_CACHE = {}
+_COMPILER_VERSIONS = {}
+
+
+def _get_cache_dir(*subdirs) -> str:
+    root = os.environ.get('EXEBENCH_CACHE_DIR')
+    if not root:
+        root = os.path.join(
+            os.environ.get('XDG_CACHE_HOME',
+                           os.path.join(os.path.expanduser('~'), '.cache')),
+            'exebench')
+    path = os.path.join(root, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class BuildCache:
+    """Content-addressed on-disk cache of build artifacts with LRU eviction.
+
+    Entries are files named after their key. Inserts go through a temporary file and
+    os.replace, so any number of processes can share a directory; lookups bump the
+    mtime, which eviction uses as the LRU order once the directory grows past
+    max_bytes. hits/misses/inserts/evictions are per-process counters.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_bytes: int = 10 * 1024**3,
+                 suffix: str = '.x'):
+        self.path = path if path is not None else _get_cache_dir(
+            'executables')
+        os.makedirs(self.path, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self._approx_bytes = None
+        self._tmp_ids = itertools.count()
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(b'\0' if part is None else
+                          str(part).encode('utf-8', 'surrogatepass') + b'\1')
+        return digest.hexdigest()
+
+    def _entry_path(self, key) -> str:
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key) -> Optional[str]:
+        path = self._entry_path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def tmp_path(self, key) -> str:
+        # Unique per call too: one process may build the same key from several
+        # threads or tasks at once
+        return f'{self._entry_path(key)}.{_get_host_process_id()}.{next(self._tmp_ids)}.tmp'
+
+    def put(self, key, path, move=False) -> str:
+        """Inserts the file at `path` (moved if move=True, else copied) and returns the entry path."""
+        entry_path = self._entry_path(key)
+        if not move:
+            tmp_path = self.tmp_path(key)
+            shutil.copy2(path, tmp_path)
+            path = tmp_path
+        os.replace(path, entry_path)
+        self.inserts += 1
+        if self._approx_bytes is not None:
+            self._approx_bytes += os.path.getsize(entry_path)
+        if self._approx_bytes is None or self._approx_bytes > self.max_bytes:
+            self.evict()
+        return entry_path
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._approx_bytes = total
+
+    def stats(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'inserts': self.inserts,
+            'evictions': self.evictions
+        }
+
+
+_DEFAULT_CACHES = {}
+
+
+def _default_cache(name, env_var, suffix, default_max_bytes) -> BuildCache:
+    if name not in _DEFAULT_CACHES:
+        _DEFAULT_CACHES[name] = BuildCache(
+            _get_cache_dir(name),
+            max_bytes=int(os.environ.get(env_var, default_max_bytes)),
+            suffix=suffix)
+    return _DEFAULT_CACHES[name]
+
+
+def _compiler_version(compiler: str) -> str:
+    if compiler not in _COMPILER_VERSIONS:
+        try:
+            _, stdout, _ = _run_command(f'{compiler} --version')
+        except (OSError, subprocess.SubprocessError):
+            stdout = ''
+        _COMPILER_VERSIONS[compiler] = stdout
+    return _COMPILER_VERSIONS[compiler]
+
+
+def _precompiled_header(compiler: str, pch_suffix: str) -> Optional[str]:
+    """Returns the path of the PCH for the harness includes, building it on first use.
+
+    The cache key covers the compiler version, the flags and the contents of every
+    precompiled header, so a stale PCH is never picked up. Returns None if it can't be built.
+    """
+    if compiler in _PCH_CACHE:
+        pch_path = _PCH_CACHE[compiler]
+        if pch_path is None or os.path.exists(pch_path):
+            return pch_path
+    digest = hashlib.sha256()
+    for part in (_compiler_version(compiler), _CXX_FLAGS, _PCH_HEADER):
+        digest.update(part.encode('utf-8'))
+    for source in _PCH_SOURCES:
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    pch_dir = _get_cache_dir(
+        'pch', f'{os.path.basename(compiler)}-{digest.hexdigest()[:16]}')
+    header_path = os.path.join(pch_dir, _PCH_HEADER_NAME)
+    pch_path = header_path + pch_suffix
+    if not os.path.exists(pch_path):
+        with open(os.path.join(pch_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # one builder per toolchain
+            if not os.path.exists(pch_path):
+                with open(header_path, 'w') as f:
+                    f.write(_PCH_HEADER)
+                tmp_pch_path = f'{pch_path}.{_get_host_process_id()}'
+                cmd = f'{compiler} {_CXX_FLAGS} -x c++-header -o {tmp_pch_path} {header_path} -I {_ROOT_PATH_FOR_JSON_HPP} -I{_SYNTH_LIBS_PATH}'
+                try:
+                    returncode, stdout, stderr = _run_command(cmd, timeout=None)
+                except OSError as e:
+                    returncode, stderr = None, str(e)
+                if returncode != 0:
+                    logging.error(f"Executing {cmd} failed with {stderr}")
+                    pch_path = None
+                else:
+                    os.replace(tmp_pch_path, pch_path)
+    _PCH_CACHE[compiler] = pch_path
+    return pch_path
+
+
+# The assemblers rename the wrapper's main() and append clib/harness_driver.h, which
+# adds a batch mode on top of the unchanged `exe input.json output.json` interface.
+_HARNESS_MAIN_RE = re.compile(
+    r'\bint\s+main\s*\(\s*int\s+\w+\s*,\s*char\s*(\*\s*\w+\s*\[\s*\]|\*\s*\*\s*\w+)\s*\)'
+)
+
+
+def _has_harness_main(cpp_wrapper: str) -> bool:
+    return len(_HARNESS_MAIN_RE.findall(cpp_wrapper)) == 1
+
+
+def _inject_harness_driver(cpp_wrapper: str) -> str:
+    if not _has_harness_main(cpp_wrapper):
+        return cpp_wrapper
+    cpp_wrapper = _HARNESS_MAIN_RE.sub(
+        'int exebench_harness_main(int argc, char* argv[])', cpp_wrapper)
+    return cpp_wrapper + '\n#include <clib/harness_driver.h>\n'
+
+
+_HARNESS_SOURCES = _PCH_SOURCES + [
+    os.path.join(_SYNTH_LIBS_PATH, 'clib', 'harness_driver.h')
+]
+_HARNESS_SOURCES_DIGEST = None
+_FAILED_OBJECTS = set()
+
+
+def _harness_sources_digest() -> str:
+    global _HARNESS_SOURCES_DIGEST
+    if _HARNESS_SOURCES_DIGEST is None:
+        digest = hashlib.sha256()
+        for source in _HARNESS_SOURCES:
+            with open(source, 'rb') as f:
+                digest.update(f.read())
+        _HARNESS_SOURCES_DIGEST = digest.hexdigest()
+    return _HARNESS_SOURCES_DIGEST
+
+
+class _CxxAssembler(_Assembler):
+    """Links the function assembly with the C++ harness using `compiler`.
+
+    With use_pch=True (or EXEBENCH_USE_PCH=1) the harness includes are taken from a
+    precompiled header, see _precompiled_header.
+
+    With cache_objects=True (the default) the wrapper and deps are compiled to an object
+    file once, stored in a BuildCache keyed by a hash of everything that goes into it
+    (under the cache dir, capped by EXEBENCH_OBJECT_CACHE_BYTES, 4 GiB by default), and
+    every new func_assembly only costs an assemble and a link. A BuildCache can also be
+    passed as cache_objects.
+    """
+    compiler = None
+    pch_suffix = None
+    batch_driver = True
+
+    def __init__(self,
+                 use_pch: Optional[bool] = None,
+                 cache_objects: Union[bool, BuildCache] = True):
+        self.use_pch = use_pch
+        self.cache_objects = cache_objects
+
+    def _object_cache(self) -> Optional[BuildCache]:
+        if isinstance(self.cache_objects, BuildCache):
+            return self.cache_objects
+        if self.cache_objects:
+            return _default_cache('objects', 'EXEBENCH_OBJECT_CACHE_BYTES',
+                                  '.o', 4 * 1024**3)
+        return None
+
+    def cache_key(self) -> str:
+        """Identifies the toolchain and harness this assembler builds with."""
+        return BuildCache.key(type(self).__name__, self.compiler,
+                              _compiler_version(self.compiler), _CXX_FLAGS,
+                              _harness_sources_digest())
+
+    def _pch_flags(self, cpp_wrapper) -> str:
+        use_pch = self.use_pch
+        if use_pch is None:
+            use_pch = os.environ.get('EXEBENCH_USE_PCH', '0') == '1'
+        # Only force-include the headers into wrappers that include them anyway
+        if not use_pch or 'nlohmann/json.hpp' not in cpp_wrapper or 'clib/synthesizer.h' not in cpp_wrapper:
+            return ''
+        pch_path = _precompiled_header(self.compiler, self.pch_suffix)
+        if pch_path is None:
+            return ''
+        return self._pch_include_flags(pch_path)
+
+    def _pch_include_flags(self, pch_path) -> str:
+        raise NotImplementedError
+
+    def _compile_failed(self, returncode, stderr) -> bool:
+        return returncode != 0
+
+    def _compiler_step(self, cmd, stage):
+        start = time.monotonic()
+        returncode, stdout, stderr = yield cmd
+        metrics.observe('exebench_stage_seconds',
+                        time.monotonic() - start,
+                        stage=stage)
+        if self._compile_failed(returncode, stderr):
+            logging.error(f"Executing {cmd} failed with {stderr}")
+            return False
+        return True
+
+    @staticmethod
+    def _prepare_wrapper(cpp_wrapper, c_deps_path) -> str:
+        cpp_wrapper = re.sub(r'extern\s\"C\"\s\{\s.*\s\}',
+                             'extern "C" \n{\n#include "' + c_deps_path +
+                             '"\n}\n', cpp_wrapper)  # replace tmp path
+        return _inject_harness_driver(cpp_wrapper)
+
+    def _compile_object(self, c_deps, cpp_wrapper, cache, key):
+        tmp_object_path = cache.tmp_path(key)
+        try:
+            with _get_tmp_path(content=c_deps, suffix='.c',
+                               delete=True) as c_deps_path:
+                cpp_wrapper = self._prepare_wrapper(cpp_wrapper, c_deps_path)
+                pch_flags = self._pch_flags(cpp_wrapper)
+                with _get_tmp_path(content=cpp_wrapper,
+                                   suffix='.cpp',
+                                   delete=True) as cpp_path:
+                    cmd = f'{self.compiler} {_CXX_FLAGS}{pch_flags} -c -o {tmp_object_path} {cpp_path} -I {_ROOT_PATH_FOR_JSON_HPP} -I{_SYNTH_LIBS_PATH}'
+                    if not (yield from self._compiler_step(cmd, 'compile')):
+                        return False
+            cache.put(key, tmp_object_path, move=True)
+        finally:
+            if os.path.exists(tmp_object_path):
+                os.remove(tmp_object_path)
+        return True
+
     def __call__(self, c_deps, func_c_signature, func_assembly,
                  cpp_wrapper) -> Path:
+        return _run_steps(
+            self._build(c_deps, func_c_signature, func_assembly, cpp_wrapper))
+
+    def _build(self, c_deps, func_c_signature, func_assembly, cpp_wrapper):
+        """Generator version of __call__: yields the commands to run and gets their
+        (returncode, stdout, stderr) back, so that it can be driven by _run_steps or
+        _arun_steps."""
+        c_deps += f'\nextern {func_c_signature};\n'
+        cache = self._object_cache()
+        if cache is None:
+            return (yield from self._compile_and_link(c_deps, func_assembly,
+                                                      cpp_wrapper))
+        key = BuildCache.key(self.cache_key(), c_deps, cpp_wrapper)
+        if key in _FAILED_OBJECTS:
+            metrics.count('exebench_cache_total', cache='objects', result='failed')
+            return None
+        object_path = cache.get(key)
+        metrics.count('exebench_cache_total',
+                      cache='objects',
+                      result='miss' if object_path is None else 'hit')
+        if object_path is None:
+            if not (yield from self._compile_object(c_deps, cpp_wrapper,
+                                                    cache, key)):
+                _FAILED_OBJECTS.add(key)
+                return None
+            object_path = cache.get(key)
+        with _get_tmp_path(content=None, suffix='.x',
+                           delete=False) as executable_path, \
+                _get_tmp_path(content=func_assembly, suffix='.s',
+                              delete=True) as s_path:
+            cmd = f'{self.compiler} -o {executable_path} {object_path} {s_path}'
+            linked = False
+            try:
+                linked = yield from self._compiler_step(cmd, 'link')
+            finally:
+                if not linked:
+                    _remove_file(executable_path)
+        return Path(executable_path) if linked else None
+
+    def _compile_and_link(self, c_deps, func_assembly, cpp_wrapper):
         with _get_tmp_path(content=None, suffix='.x',
                            delete=False) as executable_path:
-            c_deps += f'\nextern {func_c_signature};\n'
-            with _get_tmp_path(content=c_deps, suffix='.c') as c_deps_path:
-                cpp_wrapper = re.sub(r'extern\s\"C\"\s\{\s.*\s\}',
-                                     'extern "C" \n{\n#include "' +
-                                     c_deps_path + '"\n}\n',
-                                     cpp_wrapper)  # replace tmp path
-                with _get_tmp_path(content=cpp_wrapper, suffix='.cpp') as cpp_path, \
-                        _get_tmp_path(content=func_assembly, suffix='.s') as s_path:
-
-                    cmd = f'g++ -fpermissive -O0 -o {executable_path} {cpp_path} {s_path} -I {_ROOT_PATH_FOR_JSON_HPP} -I{_SYNTH_LIBS_PATH}'
-
-                    returncode, stdout, stderr = _run_command(cmd)
-                    if returncode != 0:
-                        logging.error(f"Executing {cmd} failed with {stderr}")
-                        return None
+            with _get_tmp_path(content=c_deps, suffix='.c',
+                               delete=True) as c_deps_path:
+                cpp_wrapper = self._prepare_wrapper(cpp_wrapper, c_deps_path)
+                pch_flags = self._pch_flags(cpp_wrapper)
+                with _get_tmp_path(content=cpp_wrapper, suffix='.cpp', delete=True) as cpp_path, \
+                        _get_tmp_path(content=func_assembly, suffix='.s', delete=True) as s_path:
 
-        return Path(executable_path)
+                    cmd = f'{self.compiler} {_CXX_FLAGS}{pch_flags} -o {executable_path} {cpp_path} {s_path} -I {_ROOT_PATH_FOR_JSON_HPP} -I{_SYNTH_LIBS_PATH}'
+
+                    built = False
+                    try:
+                        built = yield from self._compiler_step(cmd, 'build')
+                    finally:
+                        if not built:
+                            _remove_file(executable_path)
+
+        return Path(executable_path) if built else None
+
+    def _warm_up(self):
+        """Runs the one-off blocking setup (compiler version, PCH) ahead of _build."""
+        self.cache_key()
+        use_pch = self.use_pch
+        if use_pch is None:
+            use_pch = os.environ.get('EXEBENCH_USE_PCH', '0') == '1'
+        if use_pch:
+            _precompiled_header(self.compiler, self.pch_suffix)
+
+
+class _DefaultAssembler(_CxxAssembler):
+    compiler = 'g++'
+    pch_suffix = '.gch'
+
+    def _pch_include_flags(self, pch_path) -> str:
+        # g++ picks up {header}.gch when the header itself is included
+        return f' -include {pch_path[:-len(self.pch_suffix)]} -Winvalid-pch'
 
 
 def _compile_exe_path(c_deps, func_c_signature, func_assembly, cpp_wrapper,
@@ -134,80 +1057,285 @@ def contrain_error(content: str) -> bool:
 
 
 
-def cpp2ass(cpp_code: str, func_name, opt_level="-O3") -> Tuple[bool, str, str]:
-    """Converts C++ code to assembly code and llvm using clang and llc.
-    
-    """
-    success, ll_code, s_code = True, None, None
-    if func_name is None:
-        return success, ll_code, s_code
+_CLANG = os.environ.get('EXEBENCH_CLANG', 'clang')
+_LLVM_EXTRACT = os.environ.get('EXEBENCH_LLVM_EXTRACT', 'llvm-extract')
+_LLC = os.environ.get('EXEBENCH_LLC', 'llc')
+
+
+@dataclass
+class StageResult:
+    """One tool run of an llvm_pipeline; returncode is None if it couldn't run at all."""
+    stage: str
+    returncode: Optional[int]
+    stderr: str
+    elapsed: float
+
+
+@dataclass
+class PipelineResult:
+    ll_code: Optional[str] = None
+    s_code: Optional[str] = None
+    stages: List[StageResult] = field(default_factory=list)
+
+    @property
+    def success(self) -> bool:
+        return self.s_code is not None
+
+    @property
+    def error(self) -> Optional[StageResult]:
+        """The stage that failed, if any."""
+        if self.success or not self.stages:
+            return None
+        return self.stages[-1]
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        return {stage.stage: stage.elapsed for stage in self.stages}
+
+
+def _pipeline_stage(result: PipelineResult, stage: str, args: List[str],
+                    stdin: str, timeout: Optional[float]) -> Optional[str]:
+    start = time.monotonic()
     try:
-        with _get_tmp_path(content=cpp_code, suffix='.c') as cpp_path:
-            with _get_tmp_path(content=None, suffix='.s') as s_path:
-                cmd = f"clang {opt_level} -emit-llvm -S -o {str(cpp_path)}.ll -c {cpp_path}"
-                returncode, stdout, stderr = _run_command(cmd)
-                if returncode != 0:
-                    logging.error(f"Executing {cmd} returncode: {returncode}\n stdout: {stdout}\n stderr:\n {stderr}")
-                    return False, None, None
-                # extract only the function
-                cmd = f"llvm-extract -func {func_name} {str(cpp_path)}.ll -S -o {str(cpp_path)}.ll"
-                returncode, stdout, stderr = _run_command(cmd)
-                if returncode != 0:
-                    logging.error(f"Executing {cmd} returncode: {returncode}\n stdout: {stdout}\n stderr:\n {stderr}")
-                    return False, None, None
-                cmd = f"llc -o {s_path} {str(cpp_path)}.ll"
-                returncode, stdout, stderr = _run_command(cmd)
-                if returncode != 0:
-                    logging.error(f"Executing {cmd} returncode: {returncode}\n stdout: {stdout}\n stderr:\n {stderr}")
-                    return False, None, None
-                with open(s_path, 'r') as f:
-                    s_code = f.read()
-                with open(f"{str(cpp_path)}.ll", 'r') as f:
-                    ll_code = f.read()
-                return success, ll_code, s_code
-    except Exception as e:
-        success, ll_code, s_code = False, None, None
-    finally:
-        return success, ll_code, s_code
+        output = subprocess.run(args,
+                                input=stdin,
+                                capture_output=True,
+                                text=True,
+                                timeout=timeout)
+    except (OSError, subprocess.SubprocessError) as e:
+        result.stages.append(
+            StageResult(stage, None, str(e), time.monotonic() - start))
+        if metrics.enabled:
+            _record_command(
+                stage, 'timeout' if isinstance(
+                    e, subprocess.TimeoutExpired) else 'error',
+                result.stages[-1].elapsed, len(stdin), 0)
+        logging.error(f"Executing {' '.join(args)} failed with {e}")
+        return None
+    result.stages.append(
+        StageResult(stage, output.returncode, output.stderr,
+                    time.monotonic() - start))
+    if metrics.enabled:
+        _record_command(stage, output.returncode, result.stages[-1].elapsed,
+                        len(stdin),
+                        len(output.stdout) + len(output.stderr))
+    if output.returncode != 0:
+        logging.error(
+            f"Executing {' '.join(args)} returncode: {output.returncode}\n stderr:\n {output.stderr}"
+        )
+        return None
+    return output.stdout
 
 
+def llvm_pipeline(code: str,
+                  func_name: Optional[str] = None,
+                  opt_level: str = '-O3',
+                  language: str = 'c',
+                  timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT
+                  ) -> PipelineResult:
+    """Compiles C (language='c') or LLVM IR (language='ll') to assembly.
 
-def ll2ass(ll_code: str) -> str:
-    with _get_tmp_path(content=ll_code, suffix='.ll') as ll_path:
-        with _get_tmp_path(content=None, suffix='.s') as s_path:
-            cmd = f"llc -o {s_path} {ll_path}"
-            returncode, stdout, stderr = _run_command(cmd)
-            if returncode != 0:
-                logging.error(f"Executing {cmd} failed with {stderr}")
-                return None
-            else:
-                with open(s_path, 'r') as f:
-                    s_code = f.read()
-                return s_code
+    The stages are clang -emit-llvm (C only), llvm-extract (only if func_name is given,
+    to keep just that function) and llc. Each one reads its input from a pipe and
+    writes its output to a pipe, so nothing is written to disk. The tools can be
+    overridden with EXEBENCH_CLANG, EXEBENCH_LLVM_EXTRACT and EXEBENCH_LLC.
+    """
+    if language not in ('c', 'll'):
+        raise ValueError(f'language = {language}')
+    result = PipelineResult()
+    ll_code = code
+    if language == 'c':
+        ll_code = _pipeline_stage(result, 'clang', [
+            _CLANG, opt_level, '-emit-llvm', '-S', '-o', '-', '-x', 'c', '-'
+        ], code, timeout)
+    if ll_code is not None and func_name is not None:
+        ll_code = _pipeline_stage(
+            result, 'llvm-extract',
+            [_LLVM_EXTRACT, '-func', func_name, '-S', '-o', '-', '-'],
+            ll_code, timeout)
+    if ll_code is None:
+        return result
+    result.ll_code = ll_code
+    result.s_code = _pipeline_stage(result, 'llc', [_LLC, '-o', '-', '-'],
+                                    ll_code, timeout)
+    return result
 
 
-class LLVMAssembler(_Assembler):
-    def __call__(self, c_deps, func_c_signature, func_assembly,
-                 cpp_wrapper) -> Path:
-        with _get_tmp_path(content=None, suffix='.x',
-                           delete=False) as executable_path:
-            c_deps += f'\nextern {func_c_signature};\n'
-            with _get_tmp_path(content=c_deps, suffix='.c') as c_deps_path:
-                cpp_wrapper = re.sub(r'extern\s\"C\"\s\{\s.*\s\}',
-                                     'extern "C" \n{\n#include "' +
-                                     c_deps_path + '"\n}\n',
-                                     cpp_wrapper)  # replace tmp path
-                with _get_tmp_path(content=cpp_wrapper, suffix='.cpp') as cpp_path, \
-                        _get_tmp_path(content=func_assembly, suffix='.s') as s_path:
-
-                    cmd = f'clang++ -fpermissive -O0 -o {executable_path} {cpp_path} {s_path} -I {_ROOT_PATH_FOR_JSON_HPP} -I{_SYNTH_LIBS_PATH}'
-
-                    returncode, stdout, stderr = _run_command(cmd)
-                    if returncode != 0 or contrain_error(stderr):
-                        logging.error(f"Executing {cmd} failed with {stderr}")
-                        return None
+def cpp2ass(cpp_code: str,
+            func_name: Optional[str] = None,
+            opt_level="-O3") -> Tuple[bool, str, str]:
+    """Converts C code to LLVM IR and assembly using clang, llvm-extract and llc.
+
+    Returns (success, ll_code, s_code). Without func_name the whole module is kept.
+    Use llvm_pipeline for the per-stage errors and timings.
+    """
+    result = llvm_pipeline(cpp_code, func_name, opt_level)
+    if not result.success:
+        return False, None, None
+    return True, result.ll_code, result.s_code
+
+
+def ll2ass(ll_code: str) -> Optional[str]:
+    return llvm_pipeline(ll_code, language='ll').s_code
+
+
+class LLVMAssembler(_CxxAssembler):
+    compiler = 'clang++'
+    pch_suffix = '.pch'
+
+    def _pch_include_flags(self, pch_path) -> str:
+        return f' -include-pch {pch_path}'
+
+    def _compile_failed(self, returncode, stderr) -> bool:
+        return returncode != 0 or contrain_error(stderr)
+
+
+STATUS_OK = 'ok'
+STATUS_CRASH = 'crash'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ERROR = 'error'  # e.g. the harness exited without writing a valid output
+# The harness hit one of its ResourceLimits
+STATUS_CPU_LIMIT = 'cpu_limit'
+STATUS_MEMORY_LIMIT = 'memory_limit'
+STATUS_OUTPUT_LIMIT = 'output_limit'
+STATUS_FILE_SIZE_LIMIT = 'file_size_limit'
+STATUS_PROCESS_LIMIT = 'process_limit'
+
+
+@dataclass
+class IOResult:
+    """Outcome of running the harness on one input, see Wrapper.run_batch."""
+    status: str
+    output: Optional[Dict] = None
+    returncode: Optional[int] = None
+    stdout: str = ''
+    stderr: str = ''
+    elapsed: Optional[float] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == STATUS_OK
 
-        return Path(executable_path)
+
+def _record_io_results(results: List[IOResult]):
+    for result in results:
+        metrics.count('exebench_io_results_total', status=result.status)
+        if result.elapsed is not None:
+            metrics.observe('exebench_stage_seconds',
+                            result.elapsed,
+                            stage='execute')
+
+
+_SIZE_SUFFIXES = {'k': 1024, 'm': 1024**2, 'g': 1024**3}
+# Written to stderr by harness_driver.h when an allocation or a fork fails
+_LIMIT_MARKER = '\nexebench: limit reached: '
+_MARKER_STATUSES = {
+    'memory': STATUS_MEMORY_LIMIT,
+    'processes': STATUS_PROCESS_LIMIT
+}
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """Limits for the harness processes, applied with setrlimit by the harness driver.
+
+    cpu_seconds: CPU time (RLIMIT_CPU). memory_bytes: address space (RLIMIT_AS).
+    output_bytes: stdout and stderr kept per stream; longer ones are truncated.
+    processes: RLIMIT_NPROC, which counts every process of the user (and is ignored
+    for root). file_bytes: largest file the harness can write (RLIMIT_FSIZE).
+    None leaves a limit unset. The default comes from EXEBENCH_LIMITS, in the format
+    of parse().
+    """
+    cpu_seconds: Optional[int] = None
+    memory_bytes: Optional[int] = None
+    output_bytes: Optional[int] = None
+    processes: Optional[int] = None
+    file_bytes: Optional[int] = None
+
+    _KEYS = {
+        'cpu': 'cpu_seconds',
+        'as': 'memory_bytes',
+        'output': 'output_bytes',
+        'nproc': 'processes',
+        'fsize': 'file_bytes'
+    }
+
+    @classmethod
+    def parse(cls, spec: str) -> 'ResourceLimits':
+        """Parses e.g. 'cpu=10,as=2G,output=1M,nproc=64,fsize=64M'."""
+        values = {}
+        for item in filter(None, (item.strip() for item in spec.split(','))):
+            key, _, value = item.partition('=')
+            if key not in cls._KEYS:
+                raise ValueError(f'Unknown resource limit {key!r} in {spec!r}')
+            multiplier = _SIZE_SUFFIXES.get(value[-1:].lower(), 1)
+            if multiplier != 1:
+                value = value[:-1]
+            values[cls._KEYS[key]] = int(value) * multiplier
+        return cls(**values)
+
+    @classmethod
+    def from_env(cls) -> 'ResourceLimits':
+        return cls.parse(os.environ.get('EXEBENCH_LIMITS', ''))
+
+    def spec(self) -> str:
+        """The argument of the harness driver, '' if no limit is set."""
+        return ','.join(f'{key}={getattr(self, name)}'
+                        for key, name in self._KEYS.items()
+                        if getattr(self, name) is not None)
+
+    def classify(self, result: IOResult) -> IOResult:
+        """Gives `result` the status of the limit it hit, if any."""
+        if result.returncode == -signal.SIGXCPU:
+            result.status = STATUS_CPU_LIMIT
+        elif result.returncode == -signal.SIGXFSZ:
+            result.status = STATUS_FILE_SIZE_LIMIT
+        elif not result.ok and _LIMIT_MARKER in result.stderr:
+            limit = result.stderr.rsplit(_LIMIT_MARKER, 1)[1].split('\n', 1)[0]
+            result.status = _MARKER_STATUSES.get(limit, result.status)
+        if self.output_bytes is not None and (
+                len(result.stdout) > self.output_bytes
+                or len(result.stderr) > self.output_bytes):
+            result.stdout = result.stdout[:self.output_bytes]
+            result.stderr = result.stderr[:self.output_bytes]
+            result.status = STATUS_OUTPUT_LIMIT
+        return result
+
+
+# How Wrapper passes a single input to the harness and gets its output back (the
+# batch driver always uses stdin/stdout). TRANSPORT_FD hands the harness /dev/fd/N
+# paths to anonymous in-memory files; TRANSPORT_FILE uses real temporary files.
+TRANSPORT_FD = 'fd'
+TRANSPORT_FILE = 'file'
+
+
+def _default_transport() -> str:
+    transport = os.environ.get('EXEBENCH_TRANSPORT')
+    if transport is not None:
+        return transport
+    if hasattr(os, 'memfd_create') and os.path.isdir('/dev/fd'):
+        return TRANSPORT_FD
+    return TRANSPORT_FILE
+
+
+def _read_json_output(path) -> Optional[Dict]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _read_json_fd(fd) -> Optional[Dict]:
+    with open(fd, 'rb', closefd=False) as f:
+        f.seek(0)
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
 
 
 class Wrapper:
@@ -218,10 +1346,125 @@ class Wrapper:
                  cpp_wrapper,
                  assembler_backend=_DefaultAssembler(),
                  func_def: str = None,
-                 ll_code: str = None):
-        self._compiled_exe_path = self._compile_exe_path(
-            c_deps, func_c_signature, func_assembly, cpp_wrapper,
-            assembler_backend, func_def, ll_code)
+                 ll_code: str = None,
+                 exe_cache: Union[None, bool, BuildCache] = None,
+                 transport: Optional[str] = None,
+                 limits: Optional[ResourceLimits] = None):
+        """exe_cache: BuildCache for the finished executables, keyed by every build input.
+        None enables the default one (under the cache dir, capped by
+        EXEBENCH_EXE_CACHE_BYTES, 10 GiB by default) if EXEBENCH_EXE_CACHE=1.
+
+        transport: how single inputs reach the harness, TRANSPORT_FD (in-memory files,
+        the default where supported) or TRANSPORT_FILE (temporary files, for wrappers
+        that need real paths). EXEBENCH_TRANSPORT overrides the default.
+
+        limits: ResourceLimits for every run of the harness, ResourceLimits.from_env()
+        (EXEBENCH_LIMITS) by default. Runs that hit one get its status (STATUS_*_LIMIT).
+        They need the harness driver, so they are ignored for wrappers without main().
+
+        The executable lives in the current ScratchSpace and is removed by close(), at
+        the end of a `with Wrapper(...)` block or when the Wrapper is garbage collected.
+        """
+        exe_cache = self._resolve_exe_cache(exe_cache)
+        cache_key = getattr(assembler_backend, 'cache_key', None)
+        if exe_cache and cache_key is not None:
+            self._compiled_exe_path = self._cached_compile_exe_path(
+                exe_cache, cache_key(), c_deps, func_c_signature,
+                func_assembly, cpp_wrapper, assembler_backend, func_def,
+                ll_code)
+        else:
+            self._compiled_exe_path = self._compile_exe_path(
+                c_deps, func_c_signature, func_assembly, cpp_wrapper,
+                assembler_backend, func_def, ll_code)
+        self._set_runtime(assembler_backend, cpp_wrapper, transport, limits)
+        self._own_executable()
+
+    def _own_executable(self):
+        self._finalizer = None
+        if self._compiled_exe_path is not None:
+            self._finalizer = weakref.finalize(self, _remove_file,
+                                               str(self._compiled_exe_path))
+
+    def close(self):
+        """Removes the executable; the Wrapper can't be run afterwards."""
+        if self._finalizer is not None:
+            self._finalizer()
+        self._compiled_exe_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _set_runtime(self, assembler_backend, cpp_wrapper, transport, limits):
+        self._batch_driver = getattr(assembler_backend, 'batch_driver',
+                                     False) and _has_harness_main(cpp_wrapper)
+        self._transport = transport or _default_transport()
+        if self._transport not in (TRANSPORT_FD, TRANSPORT_FILE):
+            raise ValueError(f'Unknown transport {self._transport!r}')
+        self._limits = limits if limits is not None else ResourceLimits.from_env()
+        self._limits_spec = self._limits.spec()
+        if self._limits_spec and not self._batch_driver:
+            logging.warning(
+                'Resource limits need the harness driver, running without them')
+            self._limits_spec = ''
+
+    @classmethod
+    async def acompile(cls,
+                       c_deps,
+                       func_c_signature,
+                       func_assembly,
+                       cpp_wrapper,
+                       assembler_backend=_DefaultAssembler(),
+                       func_def: str = None,
+                       ll_code: str = None,
+                       exe_cache: Union[None, bool, BuildCache] = None,
+                       transport: Optional[str] = None,
+                       limits: Optional[ResourceLimits] = None):
+        """Async counterpart of Wrapper(...).
+
+        The compiler runs as an asyncio subprocess, subject to set_async_concurrency, and
+        is killed if the task is cancelled. Custom assemblers (without _build) and
+        func_def / ll_code inputs are compiled in a thread instead.
+        """
+        if getattr(assembler_backend, '_build',
+                   None) is None or func_def is not None or ll_code is not None:
+            async with _async_semaphore():
+                return await asyncio.to_thread(cls, c_deps, func_c_signature,
+                                               func_assembly, cpp_wrapper,
+                                               assembler_backend, func_def,
+                                               ll_code, exe_cache, transport,
+                                               limits)
+        await asyncio.to_thread(assembler_backend._warm_up)
+        self = cls.__new__(cls)
+        self._set_runtime(assembler_backend, cpp_wrapper, transport, limits)
+        exe_cache = cls._resolve_exe_cache(exe_cache)
+        key = None
+        if exe_cache:
+            key = BuildCache.key(assembler_backend.cache_key(), c_deps,
+                                 func_c_signature, func_assembly, cpp_wrapper,
+                                 func_def, ll_code)
+            self._compiled_exe_path = cls._link_cached_exe(exe_cache, key)
+            if self._compiled_exe_path is not None:
+                self._own_executable()
+                return self
+        self._compiled_exe_path = await _arun_steps(
+            assembler_backend._build(c_deps, func_c_signature, func_assembly,
+                                     cpp_wrapper))
+        if key is not None and self._compiled_exe_path is not None:
+            exe_cache.put(key, self._compiled_exe_path)
+        self._own_executable()
+        return self
+
+    @staticmethod
+    def _resolve_exe_cache(exe_cache) -> Optional[BuildCache]:
+        if exe_cache is None:
+            exe_cache = os.environ.get('EXEBENCH_EXE_CACHE', '0') == '1'
+        if exe_cache is True:
+            return _default_cache('executables', 'EXEBENCH_EXE_CACHE_BYTES',
+                                  '.x', 10 * 1024**3)
+        return exe_cache or None
 
     @staticmethod
     def _compile_exe_path(c_deps,
@@ -231,86 +1474,459 @@ class Wrapper:
                           assembler_backend,
                           func_def: str = None,
                           ll_code: str = None):
-        success = True
         if func_def is not None:
-            success, _, func_assembly = cpp2ass(func_def)
+            _, _, func_assembly = cpp2ass(func_def)
         if ll_code is not None:
             func_assembly = ll2ass(ll_code)
-        if (func_def is not None or ll_code is not None) and not success:
+        if func_assembly is None:
             return None
         return _compile_exe_path(c_deps, func_c_signature, func_assembly,
                                  cpp_wrapper, assembler_backend)
 
-    def __call__(self, inp, return_stdout_and_stderr=False):
-        executable = self._compiled_exe_path
-        if executable is None:
+    @classmethod
+    def _cached_compile_exe_path(cls, exe_cache, assembler_key, *build_inputs):
+        key = BuildCache.key(assembler_key, *build_inputs[:4],
+                             *build_inputs[5:])
+        executable_path = cls._link_cached_exe(exe_cache, key)
+        metrics.count('exebench_cache_total',
+                      cache='executables',
+                      result='miss' if executable_path is None else 'hit')
+        if executable_path is not None:
+            return executable_path
+        executable_path = cls._compile_exe_path(*build_inputs)
+        if executable_path is not None:
+            exe_cache.put(key, executable_path)
+        return executable_path
+
+    @staticmethod
+    def _link_cached_exe(exe_cache, key) -> Optional[Path]:
+        cached_path = exe_cache.get(key)
+        if cached_path is None:
             return None
-        with _get_tmp_path(content=None,
-                           suffix='.json') as input_tmp_json_path:
-            output_file = ''.join(
-                input_tmp_json_path.split(".")[:1]) + '-out.json'
+        with _get_tmp_path(content=None, suffix='.x',
+                           delete=False) as executable_path:
+            # A private link, so that eviction can't remove it under our feet
+            try:
+                os.remove(executable_path)
+                os.link(cached_path, executable_path)
+            except OSError:
+                shutil.copy2(cached_path, executable_path)
+        return Path(executable_path)
 
-            with open(input_tmp_json_path, 'w') as f:
-                json.dump(inp, f)
+    def __call__(self,
+                 inp,
+                 return_stdout_and_stderr=False,
+                 timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT):
+        """Runs the harness on `inp` and returns its output.
 
-            returncode, stdout, stderr = _run_command(
-                f'{executable} {input_tmp_json_path} {output_file}')
+        The output is None if the harness did not write one. Timeouts raise
+        subprocess.TimeoutExpired.
+        """
+        if self._compiled_exe_path is None:
+            return None
+        result = _run_steps(self._single_steps(inp, timeout))
+        if result.status == STATUS_TIMEOUT:
+            raise subprocess.TimeoutExpired(str(self._compiled_exe_path),
+                                            timeout)
+        if return_stdout_and_stderr:
+            return result.output, result.stdout, result.stderr
+        return result.output
 
-            with open(output_file, 'r') as f:
-                output = json.load(f)
-            os.remove(output_file)
+    async def acall(self,
+                    inp,
+                    return_stdout_and_stderr=False,
+                    timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT):
+        """Async counterpart of __call__.
 
+        The output is None if the harness did not write one. On timeout or cancellation
+        the harness is killed; timeouts raise subprocess.TimeoutExpired.
+        """
+        if self._compiled_exe_path is None:
+            return None
+        result = await _arun_steps(self._single_steps(inp, timeout))
+        if result.status == STATUS_TIMEOUT:
+            raise subprocess.TimeoutExpired(str(self._compiled_exe_path),
+                                            timeout)
         if return_stdout_and_stderr:
-            return output, stdout, stderr
+            return result.output, result.stdout, result.stderr
+        return result.output
 
-        return output
+    def run_batch(
+            self,
+            inputs: List[Dict],
+            timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT
+    ) -> Optional[List[IOResult]]:
+        """Runs the harness on every input and returns one IOResult per input.
 
+        If the harness was built with the batch driver all the inputs go through a single
+        process, which forks a child per input; otherwise the executable is run once per
+        input. Either way crashes and timeouts (`timeout` seconds per input) are reported
+        per input. Returns None if the wrapper could not be compiled.
+        """
+        if self._compiled_exe_path is None:
+            return None
+        if not self._batch_driver:
+            return [
+                _run_steps(self._single_steps(inp, timeout)) for inp in inputs
+            ]
+        return _run_steps(self._batch_steps(inputs, timeout))
 
-def diff_io(observed_output, expected_output) -> bool:
-    if type(observed_output) is not type(expected_output):
-        return False
-    if isinstance(observed_output, list):
-        if len(observed_output) != len(expected_output):
-            return False
-        for e1, e2 in zip(observed_output, expected_output):
-            ok = diff_io(e1, e2)
-            if not ok:
-                return False
-    elif isinstance(observed_output, dict):
-        for key in observed_output:
-            if key not in expected_output:
-                return False
-            ok = diff_io(observed_output[key], expected_output[key])
-            if not ok:
-                return False
-    elif isinstance(observed_output, float):
-        ok = math.isclose(observed_output, expected_output)
-        if not ok:
-            return False
-    else:
-        ok = observed_output == expected_output
-        if not ok:
-            return False
-    return True
+    async def arun_batch(
+            self,
+            inputs: List[Dict],
+            timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT
+    ) -> Optional[List[IOResult]]:
+        """Async counterpart of run_batch."""
+        if self._compiled_exe_path is None:
+            return None
+        if not self._batch_driver:
+            return list(await asyncio.gather(*[
+                _arun_steps(self._single_steps(inp, timeout)) for inp in inputs
+            ]))
+        return await _arun_steps(self._batch_steps(inputs, timeout))
 
+    def _batch_steps(self, inputs, timeout):
+        timeout_ms = int(timeout * 1000) if timeout else 0
+        total_timeout = None if not timeout else timeout * len(
+            inputs) + _DEFAULT_CMD_TIMEOUT
+        start = time.monotonic()
+        stdin = ''.join(json.dumps(inp) + '\n' for inp in inputs)
+        if metrics.enabled:
+            metrics.observe('exebench_stage_seconds',
+                            time.monotonic() - start,
+                            stage='json_encode')
+        try:
+            returncode, stdout, stderr = yield (
+                f'{self._compiled_exe_path} --exebench-batch {timeout_ms} {self._limits_spec}',
+                stdin, total_timeout)
+        except subprocess.TimeoutExpired as e:
+            stdout, stderr = e.stdout or '', e.stderr or ''
+            stdout = stdout.decode('utf-8', 'replace') if isinstance(
+                stdout, bytes) else stdout
+            stderr = stderr.decode('utf-8', 'replace') if isinstance(
+                stderr, bytes) else stderr
+        start = time.monotonic()
+        results = []
+        for line in stdout.splitlines()[:len(inputs)]:
+            try:
+                results.append(IOResult(**json.loads(line)))
+            except (ValueError, TypeError):
+                break
+        if metrics.enabled:
+            metrics.observe('exebench_stage_seconds',
+                            time.monotonic() - start,
+                            stage='json_decode')
+        # The driver itself died or was killed; whatever it did not get to is lost
+        results += [
+            IOResult(STATUS_ERROR, stderr=stderr)
+            for _ in range(len(inputs) - len(results))
+        ]
+        if self._limits_spec:
+            results = [self._limits.classify(result) for result in results]
+        if metrics.enabled:
+            _record_io_results(results)
+        return results
 
-def _fix_nested_dict(inp):  # hack
+    def _single_steps(self, inp, timeout):
+        if self._transport == TRANSPORT_FD:
+            result = yield from self._fd_steps(inp, timeout)
+        else:
+            result = yield from self._file_steps(inp, timeout)
+        if self._limits_spec:
+            result = self._limits.classify(result)
+        if metrics.enabled:
+            _record_io_results([result])
+        return result
 
-    if isinstance(inp, dict):
-        for k in inp:
-            inp[k] = _fix_nested_dict(inp[k])
-    elif isinstance(inp, list):
-        for idx, e in enumerate(inp):
-            inp[idx] = _fix_nested_dict(e)
-    else:
-        return literal_eval(inp)
-    return inp
+    def _fd_steps(self, inp, timeout):
+        # The harness opens /dev/fd/N like any other path, so unmodified wrappers work
+        in_fd = os.memfd_create('exebench-input')
+        out_fd = os.memfd_create('exebench-output')
+        try:
+            start = time.monotonic()
+            with open(in_fd, 'w', closefd=False) as f:
+                json.dump(inp, f)
+            if metrics.enabled:
+                metrics.observe('exebench_stage_seconds',
+                                time.monotonic() - start,
+                                stage='json_encode')
+            start = time.monotonic()
+            try:
+                returncode, stdout, stderr = yield (
+                    f'{self._harness_command()} /dev/fd/{in_fd} /dev/fd/{out_fd}',
+                    None, timeout, (in_fd, out_fd))
+            except subprocess.TimeoutExpired:
+                return IOResult(STATUS_TIMEOUT,
+                                elapsed=time.monotonic() - start)
+            elapsed = time.monotonic() - start
+            output = _read_json_fd(out_fd)
+            if metrics.enabled:
+                metrics.observe('exebench_stage_seconds',
+                                time.monotonic() - start - elapsed,
+                                stage='json_decode')
+        finally:
+            os.close(in_fd)
+            os.close(out_fd)
+        return self._single_result(output, returncode, stdout, stderr,
+                                   elapsed)
+
+    def _file_steps(self, inp, timeout):
+        start = time.monotonic()
+        content = json.dumps(inp)
+        if metrics.enabled:
+            metrics.observe('exebench_stage_seconds',
+                            time.monotonic() - start,
+                            stage='json_encode')
+        with _get_tmp_path(content=content, suffix='.json',
+                           delete=True) as input_tmp_json_path:
+            output_file = os.path.splitext(
+                input_tmp_json_path)[0] + '-out.json'
+            start = time.monotonic()
+            try:
+                returncode, stdout, stderr = yield (
+                    f'{self._harness_command()} {input_tmp_json_path} {output_file}',
+                    None, timeout)
+            except subprocess.TimeoutExpired:
+                _read_json_output(output_file)
+                return IOResult(STATUS_TIMEOUT,
+                                elapsed=time.monotonic() - start)
+            elapsed = time.monotonic() - start
+            output = _read_json_output(output_file)
+            if metrics.enabled:
+                metrics.observe('exebench_stage_seconds',
+                                time.monotonic() - start - elapsed,
+                                stage='json_decode')
+        return self._single_result(output, returncode, stdout, stderr,
+                                   elapsed)
+
+    def _harness_command(self) -> str:
+        if self._limits_spec:
+            return f'{self._compiled_exe_path} --exebench-limits {self._limits_spec}'
+        return str(self._compiled_exe_path)
+
+    @staticmethod
+    def _single_result(output, returncode, stdout, stderr, elapsed):
+        if returncode < 0:
+            status = STATUS_CRASH
+        elif output is None:
+            status = STATUS_ERROR
+        else:
+            status = STATUS_OK
+        return IOResult(status, output, returncode, stdout, stderr, elapsed)
+
+
+@dataclass
+class IOMismatch:
+    """Where and why an observed output differs from the expected one.
+
+    path is the subscript chain from the root, e.g. "['arr'][3]" ("" for the root);
+    reason is one of 'type', 'length', 'missing key' or 'value'.
+    """
+    path: str
+    reason: str
+    observed: object
+    expected: object
+
+
+# Below this many elements, converting a float list to arrays costs more than it saves
+_NUMPY_MIN_LENGTH = 64
+
+
+def _format_io_path(path) -> str:
+    keys = []
+    while path is not None:
+        path, key = path
+        keys.append(f'[{key!r}]')
+    return ''.join(reversed(keys))
+
+
+def _first_float_mismatch(observed, expected, rel_tol, abs_tol,
+                          nan_equal) -> Optional[int]:
+    """Index of the first pair of floats that are not close, or None."""
+    # Exactly equal is the common case; the sum is NaN iff there is a NaN (or inf - inf)
+    if observed == expected:
+        total = sum(observed)
+        if total == total:
+            return None
+    default_tolerances = (rel_tol, abs_tol) == (1e-09, 0.0)
+    # map(math.isclose, ...) runs in C and beats converting to arrays, but it can't
+    # take keyword arguments, and a partial is slower than numpy
+    if np is not None and not default_tolerances and len(
+            observed) >= _NUMPY_MIN_LENGTH:
+        a = np.asarray(observed, dtype=np.float64)
+        b = np.asarray(expected, dtype=np.float64)
+        with np.errstate(invalid='ignore', over='ignore'):
+            diff = np.abs(a - b)
+            # math.isclose's (symmetric) definition; infinities only match themselves
+            close = (a == b) | (np.isfinite(diff) & (diff <= np.maximum(
+                rel_tol * np.maximum(np.abs(a), np.abs(b)), abs_tol)))
+        if nan_equal:
+            close |= np.isnan(a) & np.isnan(b)
+        if close.all():
+            return None
+        return int(np.argmin(close))
+    is_close = math.isclose if default_tolerances else functools.partial(
+            math.isclose, rel_tol=rel_tol, abs_tol=abs_tol)
+    if all(map(is_close, observed, expected)):
+        return None
+    for index, (a, b) in enumerate(zip(observed, expected)):
+        if not is_close(a, b) and not (nan_equal and a != a and b != b):
+            return index
+    return None
+
+
+def first_mismatch(observed_output,
+                   expected_output,
+                   rel_tol: float = 1e-09,
+                   abs_tol: float = 0.0,
+                   nan_equal: bool = False,
+                   strict_keys: bool = False) -> Optional[IOMismatch]:
+    """Returns the first difference between two decoded outputs, or None if they match.
+
+    Types must match exactly, lists element-wise, floats within math.isclose's rel_tol /
+    abs_tol (NaNs only match each other if nan_equal), and everything else by ==. Only
+    the observed dict keys are checked, unless strict_keys also requires the expected
+    ones. The walk is iterative, and lists of only ints or only floats are compared in
+    bulk (with numpy, if it's installed, for long float lists).
+    """
+    stack = [(None, observed_output, expected_output)]
+    while stack:
+        path, observed, expected = stack.pop()
+        if type(observed) is not type(expected):
+            return IOMismatch(_format_io_path(path), 'type', observed,
+                              expected)
+        if isinstance(observed, list):
+            if len(observed) != len(expected):
+                return IOMismatch(_format_io_path(path), 'length', observed,
+                                  expected)
+            if not observed:
+                continue
+            element_types = set(map(type, observed))
+            if len(element_types) == 1 and element_types == set(
+                    map(type, expected)):
+                element_type = element_types.pop()
+                if element_type is float:
+                    index = _first_float_mismatch(observed, expected,
+                                                  rel_tol, abs_tol, nan_equal)
+                    if index is not None:
+                        return IOMismatch(_format_io_path((path, index)),
+                                          'value', observed[index],
+                                          expected[index])
+                    continue
+                if element_type in (int, str, bool):
+                    if observed != expected:
+                        index = next(i for i, (a, b) in enumerate(
+                            zip(observed, expected)) if a != b)
+                        return IOMismatch(_format_io_path((path, index)),
+                                          'value', observed[index],
+                                          expected[index])
+                    continue
+            stack.extend(((path, i), observed[i], expected[i])
+                         for i in reversed(range(len(observed))))
+        elif isinstance(observed, dict):
+            for key in observed:
+                if key not in expected:
+                    return IOMismatch(_format_io_path((path, key)),
+                                      'missing key', observed[key], None)
+            if strict_keys:
+                for key in expected:
+                    if key not in observed:
+                        return IOMismatch(_format_io_path((path, key)),
+                                          'missing key', None, expected[key])
+            stack.extend(((path, key), observed[key], expected[key])
+                         for key in reversed(list(observed)))
+        elif isinstance(observed, float):
+            if not math.isclose(observed, expected, rel_tol=rel_tol,
+                                abs_tol=abs_tol) and not (
+                                    nan_equal and observed != observed
+                                    and expected != expected):
+                return IOMismatch(_format_io_path(path), 'value', observed,
+                                  expected)
+        elif observed != expected:
+            return IOMismatch(_format_io_path(path), 'value', observed,
+                              expected)
+    return None
+
+
+def diff_io(observed_output,
+            expected_output,
+            rel_tol: float = 1e-09,
+            abs_tol: float = 0.0,
+            nan_equal: bool = False,
+            strict_keys: bool = False) -> bool:
+    """True if observed_output matches expected_output; see first_mismatch."""
+    return first_mismatch(observed_output, expected_output, rel_tol, abs_tol,
+                          nan_equal, strict_keys) is None
+
+
+# Leaves are Python literals, and almost all of them are also valid JSON, which the C
+# json decoder parses far faster than literal_eval. JSON that would decode differently
+# (true/false/null, NaN/Infinity, \/ and \u escapes, which pair surrogates) is left to
+# literal_eval, as is everything json rejects, so the result is always literal_eval's.
+_JSON_UNSAFE_LEAF_RE = re.compile(r'true|false|null|\\[u/]')
+
+
+def _reject_json_constant(constant):
+    raise ValueError(constant)
+
+
+def _decode_io_leaf(leaf):
+    if type(leaf) is str and not _JSON_UNSAFE_LEAF_RE.search(leaf):
+        try:
+            return json.loads(leaf, parse_constant=_reject_json_constant)
+        except ValueError:
+            pass
+    return literal_eval(leaf)
+
+
+def _decode_io_value(value):
+    if isinstance(value, dict):
+        return {k: _decode_io_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_io_value(v) for v in value]
+    return _decode_io_leaf(value)
 
 
 def exebench_dict_to_dict(exebench_dict):
     keys = exebench_dict['var']
     values = exebench_dict['value']
-    return _fix_nested_dict({k: v for k, v in zip(keys, values)})
+    return {k: _decode_io_value(v) for k, v in zip(keys, values)}
+
+
+_DECODED_IO_PAIRS = collections.OrderedDict()
+_DECODED_IO_PAIRS_MAX_ENTRIES = 256
+
+
+def decode_io_pairs(io_pairs: Dict) -> Tuple[List[Dict], List[Dict]]:
+    """Decodes all the inputs and outputs of a row's synth_io_pairs / real_io_pairs.
+
+    Same as exebench_dict_to_dict on every element of io_pairs['input'] and
+    io_pairs['output']. The results of the last few hundred rows are memoized (by
+    content), so the returned dicts are shared and must not be modified.
+    """
+    try:
+        key = tuple(
+            tuple((tuple(d['var']), tuple(d['value'])) for d in io_pairs[side])
+            for side in ('input', 'output'))
+        hash(key)
+    except TypeError:  # nested values: not worth memoizing
+        key = None
+    if key is not None and key in _DECODED_IO_PAIRS:
+        if metrics.enabled:
+            metrics.count('exebench_cache_total',
+                          cache='decoded_io',
+                          result='hit')
+        _DECODED_IO_PAIRS.move_to_end(key)
+        return _DECODED_IO_PAIRS[key]
+    if metrics.enabled:
+        metrics.count('exebench_cache_total', cache='decoded_io', result='miss')
+    decoded = ([exebench_dict_to_dict(d) for d in io_pairs['input']],
+               [exebench_dict_to_dict(d) for d in io_pairs['output']])
+    if key is not None:
+        _DECODED_IO_PAIRS[key] = decoded
+        if len(_DECODED_IO_PAIRS) > _DECODED_IO_PAIRS_MAX_ENTRIES:
+            _DECODED_IO_PAIRS.popitem(last=False)
+    return decoded
 
 
 def preprocessing_c_deps(row) -> str:
@@ -329,40 +1945,722 @@ def preprocessing_c_deps(row) -> str:
     return c_deps + "\n"
 
 
-def eval_assembly(row: Dict, assembly: str) -> bool:
-    success = True
-    synth_wrapper = None
+@dataclass
+class RowResult:
+    """Outcome of evaluating one assembly against the IO pairs of one row."""
+    index: int
+    path: Optional[str]
+    compiled: bool = False
+    passed: int = 0
+    total: int = 0
+    compile_time: float = 0.0
+    run_time: float = 0.0
+    statuses: Optional[List[str]] = None  # IOResult.status of every IO pair
+    error: Optional[str] = None
+    # First difference of the first IO pair that ran but gave a wrong output
+    mismatch: Optional[IOMismatch] = None
+
+    @property
+    def success(self) -> bool:
+        return self.compiled and self.total > 0 and self.passed == self.total
+
+
+def _row_io_setup(row: Dict, io: str) -> Tuple[str, str, Dict]:
+    """Returns the (c_deps, cpp_wrapper, io_pairs) to evaluate `row` with."""
+    if io == 'auto':
+        io = 'real' if row.get('real_io_pairs') else 'synth'
+    if io == 'real':
+        return preprocessing_c_deps(
+            row), row['real_exe_wrapper'], row['real_io_pairs']
+    if io == 'synth':
+        c_deps = (row['synth_deps'] + '\n' +
+                  row['synth_io_pairs']['dummy_funcs'][0] + '\n').replace(
+                      'typedef int bool;', '')
+        return c_deps, row['synth_exe_wrapper'], row['synth_io_pairs']
+    raise ValueError(f'io = {io}')
+
+
+def _evaluate_row(row: Dict,
+                  assembly: str,
+                  c_deps: str,
+                  cpp_wrapper: str,
+                  io_pairs: Dict,
+                  assembler_backend: _Assembler,
+                  index: int = 0,
+                  timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT,
+                  limits: Optional[ResourceLimits] = None) -> RowResult:
+    result = RowResult(index=index, path=row.get('path'))
     try:
-        c_deps=(row['synth_deps'] + '\n' +
-                    row['synth_io_pairs']['dummy_funcs'][0] + '\n').replace(
-                        'typedef int bool;', '')
-        synth_wrapper = Wrapper(
+        start = time.monotonic()
+        wrapper = Wrapper(
             c_deps=c_deps + '\n',
             func_c_signature=row['func_head_types'].replace('extern', ''),
             func_assembly=assembly,
-            cpp_wrapper=row['real_exe_wrapper'],
-            assembler_backend=LLVMAssembler())
-        count, total = 0, len(row['real_io_pairs']['input'])
-        for i, o in zip(row['real_io_pairs']['input'],
-                        row['real_io_pairs']['output']):
-            observed_output = synth_wrapper(
-                exebench_dict_to_dict(i))  # Run synthetic
-            if observed_output is None:
-                logging.error('Error: The code could not be compiled')
-                success = False
-                return success
-            print(observed_output, exebench_dict_to_dict(o))
-            count += 1 if diff_io(
-                observed_output=observed_output,
-                expected_output=exebench_dict_to_dict(o)) else 0
-        success = (count == total)
-        if not success:
+            cpp_wrapper=cpp_wrapper,
+            assembler_backend=assembler_backend,
+            limits=limits)
+        result.compile_time = time.monotonic() - start
+        start = time.monotonic()
+        inputs, expected_outputs = decode_io_pairs(io_pairs)
+        io_results = wrapper.run_batch(inputs, timeout=timeout)
+        result.run_time = time.monotonic() - start
+        if io_results is None:
+            logging.error('Error: The code could not be compiled')
+            return result
+        result.compiled = True
+        result.total = len(io_results)
+        result.statuses = [r.status for r in io_results]
+        start = time.monotonic()
+        for io_result, expected_output in zip(io_results,
+                                              expected_outputs):
+            if not io_result.ok:
+                logging.debug(
+                    f"{row.get('path')}: {io_result.status} {io_result.stderr}"
+                )
+                continue
+            mismatch = first_mismatch(io_result.output, expected_output)
+            if mismatch is None:
+                result.passed += 1
+            elif result.mismatch is None:
+                result.mismatch = mismatch
+        metrics.observe('exebench_stage_seconds',
+                        time.monotonic() - start,
+                        stage='compare')
+        if result.passed != result.total:
             logging.info(
-                f"Error for {row['path']} total cases {total}, success cases {count}"
+                f"Error for {row.get('path')} total cases {result.total}, success cases {result.passed}"
             )
+    except Exception as e:
+        logging.error(f"Error for {row.get('path')}")
+        logging.error(e)
+        result.error = str(e)
+    finally:
+        if metrics.enabled:
+            metrics.count('exebench_rows_total', result=_row_outcome(result))
+    return result
+
+
+def _row_outcome(result: RowResult) -> str:
+    if result.error is not None:
+        return 'error'
+    if not result.compiled:
+        return 'not compiled'
+    return 'passed' if result.success else 'failed'
+
+
+def eval_assembly(row: Dict, assembly: str) -> bool:
+    try:
+        c_deps = (row['synth_deps'] + '\n' +
+                  row['synth_io_pairs']['dummy_funcs'][0] + '\n').replace(
+                      'typedef int bool;', '')
     except Exception as e:
         logging.error(f"Error for {row['path']}")
         logging.error(e)
-        success = False
+        return False
+    return _evaluate_row(row, assembly, c_deps, row['real_exe_wrapper'],
+                         row['real_io_pairs'], LLVMAssembler()).success
+
+
+def _evaluate_chunk(chunk, assembler_backend, io, timeout,
+                    limits=None) -> List[RowResult]:
+    results = []
+    for index, row, assembly in chunk:
+        try:
+            c_deps, cpp_wrapper, io_pairs = _row_io_setup(row, io)
+        except Exception as e:
+            results.append(RowResult(index, row.get('path'), error=str(e)))
+            continue
+        results.append(
+            _evaluate_row(row, assembly, c_deps, cpp_wrapper, io_pairs,
+                          assembler_backend, index, timeout, limits))
+    return results
+
+
+def _process_pool(workers, max_tasks_per_child):
+    if max_tasks_per_child is None:
+        return concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        return concurrent.futures.ProcessPoolExecutor(
+            workers, max_tasks_per_child=max_tasks_per_child)
+    except TypeError:  # Python < 3.11, workers are never recycled
+        return concurrent.futures.ProcessPoolExecutor(workers)
+
+
+def evaluate_rows(rows: Iterable[Dict],
+                  assembly_getter: Callable[[Dict], str],
+                  workers: int = os.cpu_count(),
+                  io: str = 'auto',
+                  assembler_backend: Optional[_Assembler] = None,
+                  chunksize: int = 1,
+                  max_tasks_per_child: Optional[int] = 100,
+                  ordered: bool = True,
+                  timeout: Optional[float] = _DEFAULT_CMD_TIMEOUT,
+                  max_retries: int = 2,
+                  limits: Optional[ResourceLimits] = None) -> Iterator[RowResult]:
+    """Evaluates assembly_getter(row) against the IO pairs of every row, in parallel.
+
+    Yields one RowResult per row, in input order if ordered=True, else as they complete.
+    io selects the deps/wrapper/IO pairs: 'real', 'synth' or 'auto' (real if the row has
+    real IO pairs). Rows are sent to a pool of `workers` processes in chunks of
+    `chunksize`; workers are replaced after max_tasks_per_child chunks. If a worker dies
+    the pool is rebuilt and the rows it was holding are retried one by one, up to
+    max_retries times, before being reported with error='worker died'.
+    assembly_getter runs in the calling process, so it can be any callable.
+    limits: ResourceLimits for the harness, see Wrapper.
+    """
+    if assembler_backend is None:
+        assembler_backend = _DefaultAssembler()
+    items = ((index, row, assembly_getter(row))
+             for index, row in enumerate(rows))
+    chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _evaluate_chunk(chunk, assembler_backend, io, timeout,
+                                       limits)
+        return
+
+    executor = _process_pool(workers, max_tasks_per_child)
+    pending = {}  # future -> (chunk, attempt)
+    retries = collections.deque()
+    finished_results = {}
+    next_index = 0
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                if retries:
+                    # Suspects of a pool crash run alone, so that a new crash
+                    # can be pinned on them
+                    if pending:
+                        break
+                    chunk, attempt = retries.popleft()
+                    pending[executor.submit(_collecting_metrics,
+                                            _evaluate_chunk, metrics.enabled,
+                                            chunk, assembler_backend, io,
+                                            timeout, limits)] = (chunk, attempt)
+                    break
+                else:
+                    chunk, attempt = next(chunks, None), 0
+                    if chunk is None:
+                        break
+                future = executor.submit(_collecting_metrics,
+                                         _evaluate_chunk, metrics.enabled,
+                                         chunk, assembler_backend, io, timeout,
+                                         limits)
+                pending[future] = (chunk, attempt)
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            convicted = len(pending) == 1
+            if any(
+                    isinstance(future.exception(), BrokenProcessPool)
+                    for future in done):
+                # A dead worker breaks the whole pool: every in-flight chunk fails
+                concurrent.futures.wait(pending)
+                done = list(pending)
+                executor.shutdown(wait=False)
+                executor = _process_pool(workers, max_tasks_per_child)
+            results = []
+            for future in done:
+                chunk, attempt = pending.pop(future)
+                exception = future.exception()
+                if exception is None:
+                    chunk_results, snapshot = future.result()
+                    results += chunk_results
+                    if snapshot is not None:
+                        metrics.merge(snapshot)
+                elif isinstance(exception, BrokenProcessPool) and (
+                        not convicted or attempt < max_retries):
+                    attempt += 1 if convicted else 0
+                    retries.extend(([item], attempt) for item in chunk)
+                else:
+                    error = 'worker died' if isinstance(
+                        exception, BrokenProcessPool) else str(exception)
+                    results += [
+                        RowResult(index, row.get('path'), error=error)
+                        for index, row, _ in chunk
+                    ]
+            if not ordered:
+                yield from results
+                continue
+            for result in results:
+                finished_results[result.index] = result
+            while next_index in finished_results:
+                yield finished_results.pop(next_index)
+                next_index += 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Reading the raw dataset: <split>.tar files (or already extracted directories) of
+# jsonlines shards compressed with zstandard, as on https://huggingface.co/datasets/jordiae/exebench
+
+_SHARD_SUFFIXES = ('.jsonl.zst', '.jsonl.zstd', '.json.zst', '.jsonl')
+_END_OF_SHARD = object()
+
+
+def _is_shard(name: str) -> bool:
+    return name.endswith(_SHARD_SUFFIXES)
+
+
+def _list_shards(path_or_dir: str, split: str) -> List[Tuple[str, Optional[str]]]:
+    """Returns (file path, tar member name or None) for every shard of `split`."""
+    if os.path.isfile(path_or_dir):
+        files = [path_or_dir]
+    else:
+        files = sorted(
+            glob.glob(os.path.join(path_or_dir, glob.escape(split) + '.tar*')) +
+            glob.glob(os.path.join(path_or_dir, glob.escape(split), '**', '*'),
+                      recursive=True))
+    shards = []
+    for path in files:
+        if _is_shard(path):
+            shards.append((path, None))
+        elif os.path.isfile(path) and tarfile.is_tarfile(path):
+            with tarfile.open(path) as tar:
+                shards += [(path, member.name) for member in tar
+                           if member.isfile() and _is_shard(member.name)]
+    if not shards:
+        raise FileNotFoundError(
+            f'No shards of split {split!r} under {path_or_dir!r}')
+    return shards
+
+
+def _open_shard(path: str, member: Optional[str], tar_files: Dict,
+                opened_tar_files: List):
+    if member is None:
+        f = open(path, 'rb')
+    else:
+        # One TarFile per thread and archive: they keep a file position
+        if path not in tar_files:
+            tar_files[path] = tarfile.open(path)
+            opened_tar_files.append(tar_files[path])
+        f = tar_files[path].extractfile(member)
+    name = member or path
+    if name.endswith(('.zst', '.zstd')):
+        try:
+            import zstandard
+        except ImportError:
+            f.close()
+            raise ImportError(
+                'Reading .zst shards requires the zstandard package (pip install zstandard)'
+            )
+        f = zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+    return f
+
+
+def _hf_io_pairs(io_pairs):
+    if not isinstance(io_pairs, list):
+        return io_pairs
+    hf_io_pairs = {'input': [], 'output': [], 'dummy_funcs': [],
+                   'dummy_funcs_seed': []}
+    for pair in io_pairs:
+        for side in ('input', 'output'):
+            hf_io_pairs[side].append({
+                'var': list(pair[side]),
+                'value': list(pair[side].values())
+            })
+        hf_io_pairs['dummy_funcs'].append(pair.get('dummy_funcs'))
+        hf_io_pairs['dummy_funcs_seed'].append(pair.get('dummy_funcs_seed'))
+    return hf_io_pairs
+
+
+def _hf_field(name: str, value):
+    """Brings a field of a raw jsonlines row into the shape of the Hugging Face rows.
+
+    Raw rows keep the assemblies as {target: {'func_asm': ...}} and the IO pairs as
+    lists of {'input': {var: value}, 'output': {...}}. Fields that already look like
+    the Hugging Face ones are left alone.
+    """
+    if name == 'asm' and isinstance(value, dict) and 'target' not in value:
+        return {
+            'target': list(value),
+            'code': [
+                code.get('func_asm') if isinstance(code, dict) else code
+                for code in value.values()
+            ]
+        }
+    if name in ('synth_io_pairs', 'real_io_pairs'):
+        return _hf_io_pairs(value)
+    return value
+
+
+def _row_from_line(line: str, columns: Optional[Tuple[str, ...]],
+                   raw: bool) -> Dict:
+    row = json.loads(line)
+    if columns is not None:
+        row = {name: row[name] for name in columns if name in row}
+    if not raw:
+        row = {name: _hf_field(name, value) for name, value in row.items()}
+    return row
+
+
+class LazyRow(collections.abc.Mapping):
+    """A read-only dataset row that keeps its jsonlines text until a field is read.
+
+    The first access parses the text (keeping only `columns`, if given) and drops it;
+    every field is converted to the Hugging Face layout on its first access. Until then
+    a LazyRow pickles as its text, which makes it cheap to hand to worker processes
+    (e.g. through evaluate_rows).
+    """
+    __slots__ = ('_line', '_columns', '_raw', '_names', '_values', '_fields')
+
+    def __init__(self,
+                 line: str,
+                 columns: Optional[Iterable[str]] = None,
+                 raw: bool = False):
+        self._line = line
+        self._columns = None if columns is None else tuple(columns)
+        self._raw = raw
+        self._names = None
+        self._values = None
+        self._fields = {}
+
+    def _parse(self):
+        values = json.loads(self._line)
+        if self._columns is not None:
+            values = {
+                name: values[name]
+                for name in self._columns if name in values
+            }
+        self._names = list(values)
+        self._values = values
+        self._line = None
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            if self._line is not None:
+                self._parse()
+            # Converted fields don't keep their raw value around
+            value = self._values.pop(name)
+            self._fields[name] = value if self._raw else _hf_field(
+                name, value)
+        return self._fields[name]
+
+    def __iter__(self):
+        if self._line is not None:
+            self._parse()
+        return iter(self._names)
+
+    def __len__(self):
+        if self._line is not None:
+            self._parse()
+        return len(self._names)
+
+    def __repr__(self):
+        return f'LazyRow({self.get("path")!r})'
+
+    def __reduce_ex__(self, protocol):
+        if self._line is not None:
+            return LazyRow, (self._line, self._columns, self._raw)
+        return super().__reduce_ex__(protocol)
+
+
+def _read_shard(shard, rows: queue.Queue, stop: threading.Event,
+                batch_size: int, make_row: Callable[[str], Dict],
+                thread_state: threading.local, opened_tar_files: List):
+    """Worker thread: decompresses one shard and puts batches of rows in `rows`."""
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                rows.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        if not hasattr(thread_state, 'tar_files'):
+            thread_state.tar_files = {}
+        with _open_shard(*shard, thread_state.tar_files,
+                         opened_tar_files) as f:
+            batch = []
+            for line in io.TextIOWrapper(f, encoding='utf-8'):
+                if not line.strip():
+                    continue
+                batch.append(make_row(line))
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+        put(_END_OF_SHARD)
+    except BaseException as e:
+        put(e)
+
+
+def stream_split(path_or_dir: str,
+                 split: str,
+                 threads: int = 4,
+                 raw: bool = False,
+                 batch_size: int = 256,
+                 max_batches_per_shard: int = 4,
+                 columns: Optional[Iterable[str]] = None,
+                 lazy: bool = False) -> Iterator[Dict]:
+    """Yields the rows of `split` from a local copy of the raw dataset, in order.
+
+    path_or_dir is a <split>.tar file (or a single shard), or a directory holding
+    <split>.tar* or an extracted <split>/ directory. No network and no Arrow cache are
+    involved: shards (.jsonl.zst, or plain .jsonl) are decompressed while streaming,
+    `threads` of them at a time, each by its own thread. At most
+    max_batches_per_shard batches of batch_size rows per shard are buffered, so memory
+    stays bounded however large the split is.
+
+    Rows are converted to the layout of the Hugging Face dataset (asm as
+    {'target': [...], 'code': [...]}, IO pairs as {'input': [{'var': [...],
+    'value': [...]}], ...}) unless raw=True.
+
+    columns: only keep these fields (e.g. ['path', 'func_head_types', 'asm',
+    'synth_deps', 'synth_io_pairs', 'synth_exe_wrapper']); the others are dropped as
+    soon as a row is parsed, and never converted.
+
+    lazy: yield LazyRows, which are only parsed when a field is read (parsing then
+    happens in the consumer, not in the reader threads).
+    """
+    shards = _list_shards(path_or_dir, split)
+    columns = None if columns is None else tuple(columns)
+    make_row = functools.partial(LazyRow if lazy else _row_from_line,
+                                 columns=columns,
+                                 raw=raw)
+    stop = threading.Event()
+    thread_state = threading.local()
+    opened_tar_files = []
+    queues = collections.deque()
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=threads, thread_name_prefix='exebench_stream')
+    shard_iter = iter(shards)
+
+    def submit_next():
+        shard = next(shard_iter, None)
+        if shard is not None:
+            rows = queue.Queue(maxsize=max_batches_per_shard)
+            executor.submit(_read_shard, shard, rows, stop, batch_size,
+                            make_row, thread_state, opened_tar_files)
+            queues.append(rows)
+
+    try:
+        for _ in range(threads):
+            submit_next()
+        while queues:
+            rows = queues[0]
+            item = rows.get()
+            if item is _END_OF_SHARD:
+                queues.popleft()
+                submit_next()
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield from item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        for tar in opened_tar_files:
+            tar.close()
+
+
+# Resumable dataset transformations: the rows are cut into fixed-size shards, and the
+# transformed rows of every finished shard are committed as <output_dir>/shard-NNNNN.jsonl
+# and recorded in <output_dir>/manifest.json, so that a restarted run skips them.
+
+_MANIFEST_NAME = 'manifest.json'
+
+
+def _write_atomically(path: str, write: Callable) -> None:
+    """Calls write(f) on a temporary file that then replaces `path`, durably."""
+    tmp_path = f'{path}.{_get_host_process_id()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _transform_rows(transform, rows) -> List[Tuple[Optional[Dict], Optional[str]]]:
+    results = []
+    for row in rows:
+        try:
+            results.append((transform(row), None))
+        except Exception as e:
+            results.append((None, f"{row.get('path')}: {e!r}"))
+    return results
+
+
+class _Progress:
+    def __init__(self, total: Optional[int], interval: float):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = self.last_report = time.monotonic()
+
+    def update(self, rows: int, force: bool = False):
+        self.done += rows
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        rate = self.done / max(now - self.start, 1e-9)
+        message = f'{self.done} rows, {rate:.1f} rows/s'
+        if self.total:
+            eta = (self.total - self.done) / rate if rate else float('inf')
+            eta = int(eta) if eta != float('inf') else 0
+            message = f'{self.done}/{self.total} rows ({100 * self.done / self.total:.1f}%), {rate:.1f} rows/s, ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}'
+        logging.info(message)
+
+
+def run_sharded(rows: Iterable[Dict],
+                transform: Callable[[Dict], Optional[Dict]],
+                output_dir: str,
+                shard_size: int = 10000,
+                workers: int = os.cpu_count(),
+                chunksize: int = 16,
+                max_tasks_per_child: Optional[int] = 100,
+                max_retries: int = 2,
+                total: Optional[int] = None,
+                progress_interval: float = 30.0) -> Dict:
+    """Applies `transform` to every row and writes the results shard by shard.
+
+    transform(row) returns the new row, or None to drop it (e.g. a row that doesn't
+    compile or run); rows it raises on are dropped and counted as errors. It runs in a
+    pool of `workers` processes, so it must be picklable (a module-level function).
+
+    Rows are cut into shards of shard_size in input order. Each finished shard is
+    written to <output_dir>/shard-NNNNN.jsonl through a temporary file and os.replace,
+    then recorded in <output_dir>/manifest.json (replaced the same way). Running again
+    with the same rows and output_dir skips the shards in the manifest, without reading
+    their rows if `rows` supports len() and indexing (lists, datasets.Dataset). Progress,
+    throughput and ETA are logged every progress_interval seconds and after every shard.
+
+    Returns the manifest. The output can be read back with
+    stream_split(os.path.dirname(output_dir), os.path.basename(output_dir)).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, _MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['shard_size'] != shard_size:
+            raise ValueError(
+                f"{output_dir} was written with shard_size={manifest['shard_size']}")
+    else:
+        manifest = {
+            'shard_size': shard_size,
+            'transform': getattr(transform, '__qualname__', repr(transform)),
+            'complete': False,
+            'shards': {}
+        }
+    committed = {
+        int(index)
+        for index, shard in manifest['shards'].items()
+        if os.path.exists(os.path.join(output_dir, shard['file']))
+    }
+    indexable = hasattr(rows, '__len__') and hasattr(rows, '__getitem__')
+    if total is None and hasattr(rows, '__len__'):
+        total = len(rows)
+    if total is not None:
+        total -= sum(manifest['shards'][str(index)]['rows_in']
+                     for index in committed)
+    progress = _Progress(total, progress_interval)
+    executor = _process_pool(
+        workers, max_tasks_per_child) if workers > 1 else None
+    row_iterator = iter(rows)
+    try:
+        for shard_index in itertools.count():
+            if indexable:
+                start = shard_index * shard_size
+                if start >= len(rows):
+                    break
+                if shard_index in committed:
+                    continue
+                shard_rows = [
+                    rows[i]
+                    for i in range(start, min(start + shard_size, len(rows)))
+                ]
+            else:
+                shard_rows = list(itertools.islice(row_iterator, shard_size))
+                if not shard_rows:
+                    break
+                if shard_index in committed:
+                    continue
+            start_time = time.monotonic()
+            for attempt in itertools.count():
+                try:
+                    results = []
+                    chunks = [
+                        shard_rows[i:i + chunksize]
+                        for i in range(0, len(shard_rows), chunksize)
+                    ]
+                    snapshots = []
+                    if executor is None:
+                        chunk_results = map(
+                            functools.partial(_transform_rows, transform),
+                            chunks)
+                    else:
+                        chunk_results = executor.map(
+                            functools.partial(_collecting_metrics,
+                                              _transform_rows,
+                                              metrics.enabled, transform),
+                            chunks)
+                    for chunk, chunk_result in zip(chunks, chunk_results):
+                        if executor is not None:
+                            chunk_result, snapshot = chunk_result
+                            snapshots.append(snapshot)
+                        results += chunk_result
+                        progress.update(len(chunk))
+                    # Only once the shard is done: a retry would count it twice
+                    for snapshot in filter(None, snapshots):
+                        metrics.merge(snapshot)
+                    break
+                except BrokenProcessPool:
+                    progress.done -= len(results)
+                    if attempt >= max_retries:
+                        raise
+                    logging.warning(
+                        f'A worker died during shard {shard_index}, retrying it')
+                    executor.shutdown(wait=False)
+                    executor = _process_pool(workers, max_tasks_per_child)
+            errors = [error for _, error in results if error is not None]
+            for error in errors[:10]:
+                logging.error(f'Shard {shard_index}: {error}')
+            output = [
+                row if isinstance(row, dict) else dict(row)
+                for row, _ in results if row is not None
+            ]
+            shard_file = f'shard-{shard_index:05d}.jsonl'
+
+            def write_rows(f):
+                for row in output:
+                    f.write(json.dumps(row) + '\n')
+
+            _write_atomically(os.path.join(output_dir, shard_file),
+                              write_rows)
+            manifest['shards'][str(shard_index)] = {
+                'file': shard_file,
+                'rows_in': len(shard_rows),
+                'rows_out': len(output),
+                'errors': len(errors),
+                'elapsed': time.monotonic() - start_time,
+                'committed_at': time.time()
+            }
+            _write_atomically(manifest_path,
+                              lambda f: json.dump(manifest, f, indent=2))
+            logging.info(
+                f'Committed shard {shard_index}: {len(output)}/{len(shard_rows)} rows kept'
+            )
+            progress.update(0, force=True)
     finally:
-        return success
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    manifest['complete'] = True
+    _write_atomically(manifest_path, lambda f: json.dump(manifest, f, indent=2))
+    return manifest
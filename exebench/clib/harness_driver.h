@@ -0,0 +1,319 @@
+// Entry point appended to the ExeBench C++ wrappers by the exebench assemblers.
+// The wrapper's own main() is renamed to exebench_harness_main(), so that
+//
+//   ./wrapper input.json output.json
+//
+// behaves exactly as before, while
+//
+//   ./wrapper --exebench-batch TIMEOUT_MS
+//
+// reads one JSON input per line from stdin, runs the wrapper on each of them in a
+// forked child (so that crashes, timeouts and global state don't leak across inputs)
+// and writes one JSON result per line to stdout:
+//
+//   {"status": "ok" | "crash" | "timeout" | "error",
+//    "returncode": int (-signal if the child was killed) | null,
+//    "output": <wrapper output> | null, "stdout": str, "stderr": str, "elapsed": seconds}
+//
+// Resource limits for the wrapper (see exebench.ResourceLimits) are passed as
+//
+//   ./wrapper --exebench-limits LIMITS input.json output.json
+//   ./wrapper --exebench-batch TIMEOUT_MS LIMITS
+//
+// where LIMITS is e.g. "cpu=10,as=1073741824,nproc=64,fsize=67108864,output=1048576".
+// cpu, as, nproc and fsize are applied with setrlimit in the process that runs the
+// wrapper; output caps the stdout and stderr kept by the batch driver. Failed
+// allocations and forks are reported on stderr (EXEBENCH_LIMIT_MARKER), since they
+// don't kill the process by themselves.
+
+#ifndef EXEBENCH_CLIB_HARNESS_DRIVER_H
+#define EXEBENCH_CLIB_HARNESS_DRIVER_H
+
+#include <cerrno>
+#include <chrono>
+#include <csignal>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <string>
+
+#include <fcntl.h>
+#include <sys/resource.h>
+#include <sys/time.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#if defined(__linux__)
+#include <sys/syscall.h>
+#endif
+
+#include <nlohmann/json.hpp>
+
+int exebench_harness_main(int argc, char *argv[]);
+
+#define EXEBENCH_LIMIT_MARKER "\nexebench: limit reached: "
+
+static void exebench_limit_reached(const char *limit) {
+    // Once per process, async-signal-safe
+    static int reported = 0;
+    if (reported)
+        return;
+    reported = 1;
+    int saved_errno = errno;
+    ssize_t ignored = write(STDERR_FILENO, EXEBENCH_LIMIT_MARKER, strlen(EXEBENCH_LIMIT_MARKER));
+    ignored = write(STDERR_FILENO, limit, strlen(limit));
+    ignored = write(STDERR_FILENO, "\n", 1);
+    (void)ignored;
+    errno = saved_errno;
+}
+
+#if defined(__GLIBC__)
+// Interposed on the glibc allocator and fork, to tell limit hits from other failures
+extern "C" {
+void *__libc_malloc(size_t size);
+void *__libc_calloc(size_t count, size_t size);
+void *__libc_realloc(void *ptr, size_t size);
+pid_t __fork(void);
+
+void *malloc(size_t size) __THROW {
+    void *ptr = __libc_malloc(size);
+    if (ptr == NULL && size != 0)
+        exebench_limit_reached("memory");
+    return ptr;
+}
+
+void *calloc(size_t count, size_t size) __THROW {
+    void *ptr = __libc_calloc(count, size);
+    if (ptr == NULL && count != 0 && size != 0)
+        exebench_limit_reached("memory");
+    return ptr;
+}
+
+void *realloc(void *ptr, size_t size) __THROW {
+    void *new_ptr = __libc_realloc(ptr, size);
+    if (new_ptr == NULL && size != 0)
+        exebench_limit_reached("memory");
+    return new_ptr;
+}
+
+pid_t fork(void) __THROWNL {
+    pid_t pid = __fork();
+    if (pid < 0 && errno == EAGAIN)
+        exebench_limit_reached("processes");
+    return pid;
+}
+}
+#endif
+
+struct exebench_limits {
+    long cpu = -1, as = -1, nproc = -1, fsize = -1, output = -1;
+};
+
+static exebench_limits exebench_parse_limits(const char *spec) {
+    exebench_limits limits;
+    std::string text(spec);
+    size_t start = 0;
+    while (start < text.size()) {
+        size_t end = text.find(',', start);
+        if (end == std::string::npos)
+            end = text.size();
+        std::string item = text.substr(start, end - start);
+        size_t eq = item.find('=');
+        if (eq != std::string::npos) {
+            std::string key = item.substr(0, eq);
+            long value = atol(item.c_str() + eq + 1);
+            if (key == "cpu")
+                limits.cpu = value;
+            else if (key == "as")
+                limits.as = value;
+            else if (key == "nproc")
+                limits.nproc = value;
+            else if (key == "fsize")
+                limits.fsize = value;
+            else if (key == "output")
+                limits.output = value;
+        }
+        start = end + 1;
+    }
+    return limits;
+}
+
+static void exebench_set_limit(int resource, rlim_t soft, rlim_t hard) {
+    struct rlimit limit;
+    if (getrlimit(resource, &limit) == 0 && limit.rlim_max != RLIM_INFINITY) {
+        soft = soft < limit.rlim_max ? soft : limit.rlim_max;
+        hard = hard < limit.rlim_max ? hard : limit.rlim_max;
+    }
+    limit.rlim_cur = soft;
+    limit.rlim_max = hard;
+    setrlimit(resource, &limit);
+}
+
+static void exebench_apply_limits(const exebench_limits &limits) {
+    // SIGXCPU at the soft CPU limit; SIGKILL a second later if it's ignored
+    if (limits.cpu >= 0)
+        exebench_set_limit(RLIMIT_CPU, (rlim_t)limits.cpu, (rlim_t)limits.cpu + 1);
+    if (limits.as >= 0)
+        exebench_set_limit(RLIMIT_AS, (rlim_t)limits.as, (rlim_t)limits.as);
+    if (limits.nproc >= 0)
+        exebench_set_limit(RLIMIT_NPROC, (rlim_t)limits.nproc, (rlim_t)limits.nproc);
+    if (limits.fsize >= 0)
+        exebench_set_limit(RLIMIT_FSIZE, (rlim_t)limits.fsize, (rlim_t)limits.fsize);
+}
+
+// Anonymous in-memory file, so inputs and outputs never touch the filesystem.
+static int exebench_scratch_fd() {
+    int fd = -1;
+#if defined(__linux__) && defined(SYS_memfd_create)
+    fd = (int)syscall(SYS_memfd_create, "exebench", 0);
+#endif
+    if (fd < 0) {
+        char path[] = "/tmp/exebench_driver_XXXXXX";
+        fd = mkstemp(path);
+        if (fd >= 0)
+            unlink(path);
+    }
+    return fd;
+}
+
+static bool exebench_write_all(int fd, const char *data, size_t size) {
+    while (size > 0) {
+        ssize_t n = write(fd, data, size);
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            return false;
+        }
+        data += n;
+        size -= (size_t)n;
+    }
+    return true;
+}
+
+static std::string exebench_read_fd(int fd, long max_size = -1) {
+    std::string content;
+    char buffer[1 << 16];
+    off_t offset = 0;
+    for (;;) {
+        size_t size = sizeof(buffer);
+        if (max_size >= 0 && (size_t)(max_size - offset) < size)
+            size = (size_t)(max_size - offset);
+        if (size == 0)
+            break;
+        ssize_t n = pread(fd, buffer, size, offset);
+        if (n < 0 && errno == EINTR)
+            continue;
+        if (n <= 0)
+            break;
+        content.append(buffer, (size_t)n);
+        offset += n;
+    }
+    return content;
+}
+
+static nlohmann::json exebench_run_one(char *argv0, const std::string &input, long timeout_ms,
+                                       const exebench_limits &limits) {
+    nlohmann::json result;
+    result["returncode"] = nullptr;
+    result["output"] = nullptr;
+    result["stdout"] = "";
+    result["stderr"] = "";
+    result["elapsed"] = 0.0;
+
+    int in_fd = exebench_scratch_fd(), out_fd = exebench_scratch_fd();
+    int stdout_fd = exebench_scratch_fd(), stderr_fd = exebench_scratch_fd();
+    if (in_fd < 0 || out_fd < 0 || stdout_fd < 0 || stderr_fd < 0 ||
+        !exebench_write_all(in_fd, input.data(), input.size())) {
+        result["status"] = "error";
+        result["stderr"] = std::string("exebench driver: ") + strerror(errno);
+        for (int fd : {in_fd, out_fd, stdout_fd, stderr_fd})
+            if (fd >= 0)
+                close(fd);
+        return result;
+    }
+    lseek(in_fd, 0, SEEK_SET);
+
+    auto start = std::chrono::steady_clock::now();
+    pid_t pid = fork();
+    if (pid == 0) {
+        dup2(stdout_fd, STDOUT_FILENO);
+        dup2(stderr_fd, STDERR_FILENO);
+        exebench_apply_limits(limits);
+        if (timeout_ms > 0) {
+            struct itimerval timer;
+            memset(&timer, 0, sizeof(timer));
+            timer.it_value.tv_sec = timeout_ms / 1000;
+            timer.it_value.tv_usec = (timeout_ms % 1000) * 1000;
+            setitimer(ITIMER_REAL, &timer, NULL);
+        }
+        char in_path[64], out_path[64];
+        snprintf(in_path, sizeof(in_path), "/dev/fd/%d", in_fd);
+        snprintf(out_path, sizeof(out_path), "/dev/fd/%d", out_fd);
+        char *args[] = {argv0, in_path, out_path, NULL};
+        int returncode = exebench_harness_main(3, args);
+        std::cout.flush();
+        fflush(NULL);
+        exit(returncode);
+    }
+
+    int status = 0;
+    if (pid < 0) {
+        result["status"] = "error";
+        result["stderr"] = std::string("exebench driver: fork failed: ") + strerror(errno);
+    } else {
+        while (waitpid(pid, &status, 0) < 0 && errno == EINTR) {
+        }
+        std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+        result["elapsed"] = elapsed.count();
+        // One byte past the limit, so that the caller can tell it was exceeded
+        long max_output = limits.output >= 0 ? limits.output + 1 : -1;
+        result["stdout"] = exebench_read_fd(stdout_fd, max_output);
+        result["stderr"] = exebench_read_fd(stderr_fd, max_output);
+        if (WIFSIGNALED(status)) {
+            result["returncode"] = -WTERMSIG(status);
+            result["status"] = WTERMSIG(status) == SIGALRM ? "timeout" : "crash";
+        } else {
+            result["returncode"] = WEXITSTATUS(status);
+            nlohmann::json output = nlohmann::json::parse(exebench_read_fd(out_fd), nullptr, false);
+            if (output.is_discarded()) {
+                result["status"] = "error";
+            } else {
+                result["status"] = "ok";
+                result["output"] = output;
+            }
+        }
+    }
+    for (int fd : {in_fd, out_fd, stdout_fd, stderr_fd})
+        close(fd);
+    return result;
+}
+
+static int exebench_batch_main(char *argv0, long timeout_ms, const exebench_limits &limits) {
+    // Results go to a private copy of stdout; the children get their own stdout
+    int protocol_fd = dup(STDOUT_FILENO);
+    std::string line;
+    while (std::getline(std::cin, line)) {
+        if (line.empty())
+            continue;
+        std::string result =
+            exebench_run_one(argv0, line, timeout_ms, limits).dump(-1, ' ', false, nlohmann::json::error_handler_t::replace);
+        result += '\n';
+        if (!exebench_write_all(protocol_fd, result.data(), result.size()))
+            return 1;
+    }
+    return 0;
+}
+
+int main(int argc, char *argv[]) {
+    if (argc >= 2 && strcmp(argv[1], "--exebench-batch") == 0)
+        return exebench_batch_main(argv[0], argc >= 3 ? atol(argv[2]) : 0,
+                                   exebench_parse_limits(argc >= 4 ? argv[3] : ""));
+    if (argc >= 3 && strcmp(argv[1], "--exebench-limits") == 0) {
+        exebench_apply_limits(exebench_parse_limits(argv[2]));
+        argv[2] = argv[0];
+        return exebench_harness_main(argc - 2, argv + 2);
+    }
+    return exebench_harness_main(argc, argv);
+}
+
+#endif // EXEBENCH_CLIB_HARNESS_DRIVER_H
@@ -1,3 +1,6 @@
+#ifndef EXEBENCH_CLIB_SYNTHESIZER_H
+#define EXEBENCH_CLIB_SYNTHESIZER_H
+
 #include <stddef.h>
 
 // Conditions
@@ -33,3 +36,5 @@ void facc_free(void* pointer);
 
 // Generic utility functions
 void facc_strcopy(char *str_in, char *str_out);
+
+#endif // EXEBENCH_CLIB_SYNTHESIZER_H